@@ -0,0 +1,322 @@
+"""
+Define a bounding volume hierarchy over the drawable Components of a scene, for frustum culling, ray casting and
+nearest object queries.
+
+:author: micou(Zezhou Sun)
+:version: 2021.1.1
+"""
+import heapq
+import math
+
+import numpy as np
+
+from GLUtility import GLUtility
+
+# finite stand-in for infinite bounds, keeps plane and slab tests free of inf * 0
+boundLimit = 1e30
+
+
+class BVH:
+    """
+    Binary tree of axis aligned boxes. Every leaf holds one Component with a Displayable, boxed around its cached world
+    bounding sphere, and every inner node boxes its two children.
+
+    Nodes are stored in flat arrays in pre-order, so a parent always has a smaller index than its children:
+        * nodeMin, nodeMax: (m, 3) corners of node boxes
+        * left, right: (m, ) child nodes, -1 for leaves
+        * parent: (m, ) parent node, -1 for the root
+        * item: (m, ) index of the leaf's Component in components, -1 for inner nodes
+
+    Components report moves to their BVH during update. refit then recomputes the moved leaves and the boxes on their
+    paths to the root only. Refitting keeps the tree valid, but not balanced, so rebuild it with build after large
+    changes, and after adding or removing Components.
+    """
+    root = None  # Component
+    components = None  # list<Component>, drawable Components below root
+    componentIndex = None  # dict<int, int>, id(component) -> index in components
+    leafOf = None  # (n, ) leaf node of every Component
+    centers = None  # (n, 3) world bounding sphere centers of Components
+    radii = None  # (n, ) world bounding sphere radii of Components, -inf without bounds
+    dirtyItems = None  # set<int>, Components whose bounds changed since the last refit
+
+    nodeCount = 0
+    nodeMin = None
+    nodeMax = None
+    left = None
+    right = None
+    parent = None
+    item = None
+
+    def __init__(self, root):
+        """
+        :param root: every Component with a Displayable below root goes into the tree
+        :type root: Component
+        """
+        self.build(root)
+
+    def build(self, root=None):
+        """
+        Build the tree again from the current bounds. Required after adding or removing Components
+
+        :param root: new top level Component, defaults to the current one
+        """
+        self.release()
+        if root is not None:
+            self.root = root
+        self.components = []
+        stack = [self.root]
+        while stack:
+            component = stack.pop()
+            if component.displayObj is not None:
+                self.components.append(component)
+            stack.extend(reversed(component.children))
+        self.componentIndex = {id(c): i for i, c in enumerate(self.components)}
+        for component in self.components:
+            component.bvh = self
+
+        n = len(self.components)
+        capacity = max(1, 2 * n - 1)
+        self.nodeMin = np.zeros((capacity, 3))
+        self.nodeMax = np.zeros((capacity, 3))
+        self.left = -np.ones(capacity, dtype=np.int64)
+        self.right = -np.ones(capacity, dtype=np.int64)
+        self.parent = -np.ones(capacity, dtype=np.int64)
+        self.item = -np.ones(capacity, dtype=np.int64)
+        self.leafOf = np.zeros(n, dtype=np.int64)
+        self.centers = np.zeros((n, 3))
+        self.radii = np.zeros(n)
+        self.dirtyItems = set()
+        self.nodeCount = 0
+
+        if n == 0:
+            return
+        itemMin, itemMax = self.itemBoxes(range(n))
+        centers = (itemMin + itemMax) / 2
+        self.buildNode(np.arange(n), -1, itemMin, itemMax, centers)
+
+    def buildNode(self, items, parent, itemMin, itemMax, centers):
+        """
+        Add the subtree of items, split at the median along the longest axis of their box centers
+
+        :return: node index of the subtree root
+        """
+        node = self.nodeCount
+        self.nodeCount += 1
+        self.parent[node] = parent
+        if len(items) == 1:
+            self.item[node] = items[0]
+            self.leafOf[items[0]] = node
+            self.nodeMin[node] = itemMin[items[0]]
+            self.nodeMax[node] = itemMax[items[0]]
+            return node
+        axis = np.argmax(np.ptp(centers[items], axis=0))
+        items = items[np.argsort(centers[items, axis], kind="stable")]
+        half = len(items) // 2
+        self.left[node] = self.buildNode(items[:half], node, itemMin, itemMax, centers)
+        self.right[node] = self.buildNode(items[half:], node, itemMin, itemMax, centers)
+        self.refitNode(node)
+        return node
+
+    def release(self):
+        """
+        Detach all Components from this tree
+        """
+        if self.components is not None:
+            for component in self.components:
+                if component.bvh is self:
+                    component.bvh = None
+
+    def itemBoxes(self, items):
+        """
+        Copy the world bounding spheres of Components into centers and radii
+
+        :return: boxes around the spheres, as min and max corners in shape (k, 3).
+                 Components without bounds get an empty box, whose min corner is greater than its max corner
+        """
+        items = list(items)
+        for i in items:
+            bounds = self.components[i].worldBounds
+            if bounds is None:
+                self.centers[i] = 0
+                self.radii[i] = -math.inf
+            else:
+                self.centers[i], self.radii[i] = bounds
+        centers = self.centers[items]
+        radii = np.clip(self.radii[items], -boundLimit, boundLimit)[:, None]
+        return np.clip(centers - radii, -boundLimit, boundLimit), np.clip(centers + radii, -boundLimit, boundLimit)
+
+    def refitNode(self, node):
+        self.nodeMin[node] = np.minimum(self.nodeMin[self.left[node]], self.nodeMin[self.right[node]])
+        self.nodeMax[node] = np.maximum(self.nodeMax[self.left[node]], self.nodeMax[self.right[node]])
+
+    def markMoved(self, component):
+        """
+        Called by Components whose world bounds changed, their leaves are refit in the next refit
+        """
+        index = self.componentIndex.get(id(component))
+        if index is not None:
+            self.dirtyItems.add(index)
+
+    def refit(self):
+        """
+        Update boxes of moved Components and of their ancestors, children before parents
+        """
+        if not self.dirtyItems:
+            return
+        items = sorted(self.dirtyItems)
+        self.dirtyItems.clear()
+        leaves = self.leafOf[items]
+        self.nodeMin[leaves], self.nodeMax[leaves] = self.itemBoxes(items)
+
+        nodes = set()
+        for leaf in leaves:
+            node = self.parent[leaf]
+            # ancestors of a node already in the set are in the set as well
+            while node != -1 and node not in nodes:
+                nodes.add(node)
+                node = self.parent[node]
+        # pre-order storage, so descending indices handle children before their parents
+        for node in sorted(nodes, reverse=True):
+            self.refitNode(node)
+
+    def emptyNode(self, node):
+        return self.nodeMin[node, 0] > self.nodeMax[node, 0]
+
+    def frustumQuery(self, camera):
+        """
+        Traverse the tree one level at a time, testing all nodes of a level at once
+
+        :param camera: camera whose view frustum is tested
+        :type camera: Camera
+        :return: Components whose bounds intersect the view frustum, possibly with a few outside of it
+        :rtype: list<Component>
+        """
+        result = []
+        planes = camera.frustumPlanes
+        positive = planes[:, 0:3] >= 0
+        frontier = np.zeros(1 if self.nodeCount > 0 else 0, dtype=np.int64)
+        while len(frontier) > 0:
+            nodeMin = self.nodeMin[frontier]
+            nodeMax = self.nodeMax[frontier]
+            # the box corner furthest along every plane normal must be inside of every plane
+            corners = np.where(positive, nodeMax[:, None, :], nodeMin[:, None, :])
+            distances = np.sum(corners * planes[:, 0:3], axis=2) + planes[:, 3]
+            frontier = frontier[np.all(distances >= 0, axis=1) & (nodeMin[:, 0] <= nodeMax[:, 0])]
+
+            items = self.item[frontier]
+            leafItems = items[items >= 0]
+            leafItems = leafItems[camera.spheresVisible(self.centers[leafItems], self.radii[leafItems])]
+            result.extend(self.components[i] for i in leafItems)
+            inner = frontier[items < 0]
+            frontier = np.concatenate((self.left[inner], self.right[inner]))
+        return result
+
+    def collect(self, renderQueue, camera):
+        """
+        Component.collect for the whole tree, visiting only Components in the view frustum
+
+        :type renderQueue: RenderQueue
+        :type camera: Camera
+        """
+        for component in self.frustumQuery(camera):
+            component.selectLod(camera)
+            renderQueue.add(component)
+
+    def rayQuery(self, origin, direction, maxDistance=math.inf):
+        """
+        Traverse the tree one level at a time, testing all nodes of a level at once
+
+        :param origin: ray origin in world coordinates
+        :param direction: ray direction in world coordinates, doesn't need to be normalized
+        :param maxDistance: ignore hits further than this, measured along the normalized direction
+        :return: (distance, Component) of every Component whose bounding sphere the ray hits, nearest first.
+                 The distance is where the ray enters the bounding sphere, 0 if the origin is inside of it
+        :rtype: list<tuple>
+        """
+        origin = np.asarray(origin, dtype=np.float64)
+        direction = np.asarray(direction, dtype=np.float64)
+        direction = direction / np.linalg.norm(direction)
+        # avoid dividing by zero, a tiny component keeps the slab test valid for rays parallel to an axis
+        safeDirection = np.where(np.abs(direction) < 1e-12, 1e-12, direction)
+        inverse = 1 / safeDirection
+        hitItems = []
+        hitDistances = []
+        frontier = np.zeros(1 if self.nodeCount > 0 else 0, dtype=np.int64)
+        while len(frontier) > 0:
+            nodeMin = self.nodeMin[frontier]
+            nodeMax = self.nodeMax[frontier]
+            t0 = (nodeMin - origin) * inverse
+            t1 = (nodeMax - origin) * inverse
+            tNear = np.max(np.minimum(t0, t1), axis=1)
+            tFar = np.min(np.maximum(t0, t1), axis=1)
+            frontier = frontier[(tNear <= tFar) & (tFar >= 0) & (tNear <= maxDistance) &
+                                (nodeMin[:, 0] <= nodeMax[:, 0])]
+
+            items = self.item[frontier]
+            leafItems = items[items >= 0]
+            distances = GLUtility.raySpheres(origin, direction, self.centers[leafItems], self.radii[leafItems])
+            hit = np.isfinite(distances) & (distances <= maxDistance)
+            hitItems.append(leafItems[hit])
+            hitDistances.append(distances[hit])
+            inner = frontier[items < 0]
+            frontier = np.concatenate((self.left[inner], self.right[inner]))
+        if not hitItems:
+            return []
+        hitItems = np.concatenate(hitItems)
+        hitDistances = np.concatenate(hitDistances)
+        order = np.argsort(hitDistances, kind="stable")
+        return [(float(hitDistances[i]), self.components[hitItems[i]]) for i in order]
+
+    def pick(self, origin, direction, maxDistance=math.inf):
+        """
+        Ray cast against the triangles of Components. Components are tested in the order the ray enters their bounding
+        spheres, and the search stops at the first sphere behind the nearest hit so far
+
+        :param origin: ray origin in world coordinates
+        :param direction: ray direction in world coordinates, doesn't need to be normalized
+        :param maxDistance: ignore hits further than this, measured along the normalized direction
+        :return: the hit Component and the hit point in world coordinates, (None, None) if the ray hits nothing
+        :rtype: tuple
+        """
+        origin = np.asarray(origin, dtype=np.float64)
+        direction = np.asarray(direction, dtype=np.float64)
+        direction = direction / np.linalg.norm(direction)
+        best, bestDistance = None, maxDistance
+        for entry, component in self.rayQuery(origin, direction, maxDistance):
+            if entry > bestDistance:
+                break
+            distance = component.intersectRay(origin, direction)
+            if distance is not None and distance <= bestDistance:
+                best, bestDistance = component, distance
+        if best is None:
+            return None, None
+        return best, origin + bestDistance * direction
+
+    def nearest(self, point, maxDistance=math.inf):
+        """
+        Best first search for the Component whose bounding sphere is closest to point
+
+        :param point: query point in world coordinates
+        :return: the nearest Component and the distance to its bounding sphere, 0 if point is inside of it.
+                 (None, maxDistance) if no Component is closer than maxDistance
+        :rtype: tuple
+        """
+        point = np.asarray(point, dtype=np.float64)
+        best, bestDistance = None, maxDistance
+        queue = [(0.0, 0)] if self.nodeCount > 0 and not self.emptyNode(0) else []
+        while queue:
+            distance, node = heapq.heappop(queue)
+            if distance >= bestDistance:
+                break
+            i = self.item[node]
+            if i >= 0:
+                distance = max(0.0, float(np.linalg.norm(point - self.centers[i]) - self.radii[i]))
+                if distance < bestDistance:
+                    best, bestDistance = self.components[i], distance
+                continue
+            for child in (self.left[node], self.right[node]):
+                if self.emptyNode(child):
+                    continue
+                gap = np.maximum(np.maximum(self.nodeMin[child] - point, point - self.nodeMax[child]), 0)
+                heapq.heappush(queue, (float(np.linalg.norm(gap)), int(child)))
+        return best, bestDistance
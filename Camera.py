@@ -0,0 +1,149 @@
+"""
+Define a class to store the viewing state of a frame, which is shared by everything that needs to know about the camera
+during drawing.
+
+:author: micou(Zezhou Sun)
+:version: 2021.1.1
+"""
+import math
+
+import numpy as np
+
+
+class Camera:
+    """
+    Camera position, view and projection matrices, viewport size, and what is derived from them: the inverse
+    view-projection matrix for unprojection, and the view frustum.
+    Matrices are stored in column-major, the same as everywhere else in GLUtility.
+    """
+    position = None  # ndarray(3)
+    viewMat = None
+    perspMat = None
+    width = 1
+    height = 1
+
+    viewProjectionMat = None  # viewMat @ perspMat
+    inverseViewProjectionMat = None
+
+    # (6, 4) ndarray, planes (a, b, c, d) of the view frustum in world coordinates with unit normals pointing inwards,
+    # in order left, right, bottom, top, near, far. A point is inside if ax + by + cz + d >= 0 for all of them
+    frustumPlanes = None
+
+    def __init__(self):
+        self.position = np.zeros(3)
+        self.viewMat = np.identity(4)
+        self.perspMat = np.identity(4)
+        self.viewProjectionChanged()
+
+    def setView(self, position, viewMat):
+        """
+        :param position: camera position in world coordinates
+        :param viewMat: view matrix built from the same camera position
+        :type viewMat: numpy.ndarray
+        """
+        self.position = np.array(position, dtype=np.float64)
+        # called every frame, most of them without any camera movement
+        if np.array_equal(viewMat, self.viewMat):
+            return
+        self.viewMat = viewMat
+        self.viewProjectionChanged()
+
+    def setProjection(self, perspMat, width, height):
+        """
+        :param perspMat: perspective matrix
+        :type perspMat: numpy.ndarray
+        :param width: viewport width in pixels
+        :param height: viewport height in pixels
+        """
+        self.perspMat = perspMat
+        self.width = width
+        self.height = max(1, height)
+        self.viewProjectionChanged()
+
+    def viewProjectionChanged(self):
+        """
+        Recompute everything derived from the view and projection matrices
+        """
+        self.viewProjectionMat = self.viewMat @ self.perspMat
+        self.inverseViewProjectionMat = np.linalg.inv(self.viewProjectionMat)
+        self.updateFrustum()
+
+    def updateFrustum(self):
+        """
+        Extract the frustum planes from the view-projection matrix (Gribb and Hartmann)
+        """
+        # matrices are column-major, so rows of the usual clip matrix are columns of this product
+        clipMat = self.viewProjectionMat.transpose()
+        planes = np.array([clipMat[3] + clipMat[0], clipMat[3] - clipMat[0],
+                           clipMat[3] + clipMat[1], clipMat[3] - clipMat[1],
+                           clipMat[3] + clipMat[2], clipMat[3] - clipMat[2]], dtype=np.float64)
+        norms = np.linalg.norm(planes[:, 0:3], axis=1)
+        norms[norms == 0] = 1
+        self.frustumPlanes = planes / norms[:, None]
+
+    def sphereVisible(self, center, radius):
+        """
+        Conservative frustum test, a sphere near a frustum corner may be reported visible while it is not
+
+        :param center: sphere center in world coordinates
+        :param radius: sphere radius in world coordinates
+        :return: False if the sphere is entirely outside of the view frustum
+        :rtype: bool
+        """
+        distances = self.frustumPlanes[:, 0:3] @ center + self.frustumPlanes[:, 3]
+        return bool(np.all(distances >= -radius))
+
+    def spheresVisible(self, centers, radii):
+        """
+        sphereVisible for many spheres at once
+
+        :param centers: sphere centers in shape (n, 3)
+        :param radii: sphere radii in shape (n, )
+        :return: visibility mask in shape (n, )
+        :rtype: numpy.ndarray
+        """
+        distances = np.asarray(centers) @ self.frustumPlanes[:, 0:3].transpose() + self.frustumPlanes[:, 3]
+        return np.all(distances >= -np.asarray(radii)[:, None], axis=1)
+
+    def unprojectPoints(self, windowPoints):
+        """
+        Same as gluUnProject with an identity model matrix and a viewport of (0, 0, width, height), for many points
+
+        :param windowPoints: window coordinates (x, y, depth) in shape (n, 3), depth in range [0, 1]
+        :return: world coordinates in shape (n, 3)
+        :rtype: numpy.ndarray
+        """
+        windowPoints = np.asarray(windowPoints, dtype=np.float64).reshape(-1, 3)
+        ndcPoints = np.empty((len(windowPoints), 4))
+        ndcPoints[:, 0] = windowPoints[:, 0] / self.width * 2 - 1
+        ndcPoints[:, 1] = windowPoints[:, 1] / self.height * 2 - 1
+        ndcPoints[:, 2] = windowPoints[:, 2] * 2 - 1
+        ndcPoints[:, 3] = 1
+        # column-major matrix, so points are multiplied from the left
+        worldPoints = ndcPoints @ self.inverseViewProjectionMat
+        return worldPoints[:, 0:3] / worldPoints[:, 3:4]
+
+    def unproject(self, x, y, depth):
+        """
+        :param x: window x coordinate in pixels
+        :param y: window y coordinate in pixels, from the bottom
+        :param depth: window depth in range [0, 1], 0 on the near plane
+        :return: world coordinates
+        :rtype: numpy.ndarray
+        """
+        return self.unprojectPoints((x, y, depth))[0]
+
+    def pixelRadius(self, center, radius):
+        """
+        Approximate the radius of a sphere after being projected on screen
+
+        :param center: sphere center in world coordinates
+        :param radius: sphere radius in world coordinates
+        :return: projected radius in pixels, inf if the camera is inside of the sphere
+        :rtype: float
+        """
+        distance = math.sqrt(np.sum((np.asarray(center) - self.position)**2))
+        if distance <= radius:
+            return math.inf
+        # perspMat[1, 1] is cot(fov/2), it maps one unit at distance one to half of the viewport height
+        return radius / distance * self.perspMat[1, 1] * self.height / 2
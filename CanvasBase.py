@@ -42,6 +42,7 @@ except ImportError:
 
 import math
 import random
+import time
 import numpy as np
 
 from Point import Point
@@ -81,7 +82,11 @@ class CanvasBase(glcanvas.GLCanvas):
     dragging_event = False
     new_dragging_event = False
 
-    fps = 120  # frame per second, -1 to disable auto refresh
+    fps = 120  # frame cap in frames per second, -1 for no cap
+
+    # on-demand rendering: a frame is only drawn after requestRedraw, and requests before it is drawn are merged
+    redrawPending = False  # a frame is scheduled on the timer
+    lastFrameTime = 0.0  # time.perf_counter() when the last frame started
 
     def __init__(self, parent):
         """
@@ -103,8 +108,9 @@ class CanvasBase(glcanvas.GLCanvas):
         self.topLevelComponent = Component(Point((0, 0, 0)))
         self.viewing_quaternion = Quaternion()
         self.timer = wx.Timer(self, 1)  # TIMER_ID set to 1
+        self.redrawPending = False
         # Bind event to functions
-        # self.Bind(wx.EVT_PAINT, self.OnPaint)
+        self.Bind(wx.EVT_PAINT, self.OnPaintEvent)
         self.Bind(wx.EVT_WINDOW_DESTROY, self.OnDestroy)
         self.Bind(wx.EVT_MOTION, self.OnMouseMotion)
         self.Bind(wx.EVT_LEFT_UP, self.OnMouseLeft)
@@ -112,11 +118,8 @@ class CanvasBase(glcanvas.GLCanvas):
         self.Bind(wx.EVT_CHAR, self.OnKeyDown)
         self.Bind(wx.EVT_SIZE, self.OnResize)
         self.Bind(wx.EVT_MOUSEWHEEL, self.OnScroll)
-        # refresh canvas with constant frame rate
-        self.Bind(wx.EVT_TIMER, self.OnPaint)
-
-        if self.fps > 0:
-            self.timer.Start(int(1000 / self.fps), oneShot=wx.TIMER_CONTINUOUS)
+        # scheduled frames are drawn by a one-shot timer
+        self.Bind(wx.EVT_TIMER, self.OnTimer)
 
     def OnScroll(self, event):
         """
@@ -126,10 +129,48 @@ class CanvasBase(glcanvas.GLCanvas):
         :return: None
         """
         self.Interrupt_Scroll(event.GetWheelRotation())
-        self.Refresh(True)
+        self.requestRedraw()
+
+    def requestRedraw(self):
+        """
+        Invalidate the canvas. The next frame is scheduled once, however many times this is called before it is drawn,
+        and no sooner than the frame cap allows
+
+        :return: None
+        """
+        if self.redrawPending:
+            return
+        self.redrawPending = True
+        delay = 0
+        if self.fps > 0:
+            delay = self.lastFrameTime + 1 / self.fps - time.perf_counter()
+        self.timer.StartOnce(max(1, int(math.ceil(delay * 1000))))
+
+    def needsContinuousRedraw(self):
+        """
+        Override to keep drawing frames without any request, e.g. while an animation is running
+
+        :rtype: bool
+        """
+        return False
 
     def OnTimer(self, event):
+        self.redrawPending = False
+        self.lastFrameTime = time.perf_counter()
         self.OnPaint(event)
+        if self.needsContinuousRedraw():
+            self.requestRedraw()
+
+    def OnPaintEvent(self, event):
+        """
+        The window system asks for a repaint, e.g. after the canvas was uncovered. A paint event must always create a
+        PaintDC, the frame itself is drawn by the scheduler
+
+        :param event: wxpython paint event
+        :return: None
+        """
+        wx.PaintDC(self)
+        self.requestRedraw()
 
     def OnResize(self, event):
         """
@@ -138,15 +179,17 @@ class CanvasBase(glcanvas.GLCanvas):
         :param event: Canvas resize event
         :return: None
         """
-        self.context = glcanvas.GLContext(self)
+        # keep the context of earlier sizes, recreating it would lose every GPU object
+        if self.context is None:
+            self.context = glcanvas.GLContext(self)
         self.size = self.GetClientSize()
         self.size[1] = max(1, self.size[1])  # avoid divided by 0
-        self.SetCurrent(self.context)
+        if self.init:
+            self.SetCurrent(self.context)
+            gl.glViewport(0, 0, self.size[0], self.size[1])
 
         # Update screen and display
-        self.init = False
-        self.Refresh(eraseBackground=True)
-        self.Update()
+        self.requestRedraw()
 
     def OnIdle(self, event):
         pass
@@ -267,23 +310,22 @@ class CanvasBase(glcanvas.GLCanvas):
             self.new_dragging_event = not self.dragging_event
             self.dragging_event = True
             self.Interrupt_MouseLeftDragging(event.GetX(), self.size[1] - event.GetY())
-            self.Refresh(True)
+            self.requestRedraw()
         elif event.RightIsDown():
             # If this is a dragging event with right button down
             self.new_dragging_event = not self.dragging_event
             self.dragging_event = True
             self.Interrupt_MouseMiddleDragging(event.GetX(), self.size[1] - event.GetY()) # use middle method
-            self.Refresh(True)
+            self.requestRedraw()
         elif event.MiddleIsDown():
             self.new_dragging_event = not self.dragging_event
             self.dragging_event = True
             self.Interrupt_MouseMiddleDragging(event.GetX(), self.size[1] - event.GetY())
-            self.Refresh(True)
+            self.requestRedraw()
         else:
-            # Normal Mouse Moving
+            # Normal Mouse Moving, which changes nothing on screen unless Interrupt_MouseMoving requests a redraw
             self.dragging_event = False
             self.Interrupt_MouseMoving(event.GetX(), self.size[1] - event.GetY())
-            self.Refresh(True)
 
     # Definition for interface
     def OnMouseLeft(self, event):
@@ -296,7 +338,7 @@ class CanvasBase(glcanvas.GLCanvas):
         x = event.GetX()
         y = event.GetY()
         self.Interrupt_MouseL(x, self.size[1] - y)
-        self.Refresh(True)
+        self.requestRedraw()
 
     def OnMouseRight(self, event):
         """
@@ -308,7 +350,7 @@ class CanvasBase(glcanvas.GLCanvas):
         x = event.GetX()
         y = event.GetY()
         self.Interrupt_MouseR(x, self.size[1] - y)
-        self.Refresh(True)
+        self.requestRedraw()
 
     def OnKeyDown(self, event):
         """
@@ -319,7 +361,7 @@ class CanvasBase(glcanvas.GLCanvas):
         """
         keycode = event.GetKeyCode()
         self.Interrupt_Keyboard(keycode)
-        self.Refresh(True)
+        self.requestRedraw()
 
     def modelUpdate(self):
         """
@@ -328,7 +370,7 @@ class CanvasBase(glcanvas.GLCanvas):
         :return: None
         """
         self.stateChanged = True
-        self.Refresh(True)
+        self.requestRedraw()
 
     def Interrupt_Scroll(self, wheelRotation):
         pass
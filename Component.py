@@ -5,12 +5,12 @@ First version in 11/01/2021
 :author: micou(Zezhou Sun)
 :version: 2021.1.1
 """
+import contextlib
 import copy
 import math
 import os
 
 import numpy as np
-from PIL import Image
 
 import GLBuffer
 from Material import Material
@@ -19,7 +19,7 @@ from ColorType import ColorType
 from Displayable import Displayable
 from Quaternion import Quaternion
 from GLUtility import GLUtility
-from GLBuffer import Texture
+from TextureCache import TextureCache
 
 try:
     import OpenGL
@@ -49,9 +49,36 @@ except ImportError:
 
 class Component:
     children = None  # list
+    parent = None  # Component
 
     # the homogeneous transformation matrix for the current joint
     transformationMat = None
+    # normal matrix of transformationMat, see GLUtility.normalMatrices. Only kept for components with a Displayable
+    normalMat = None
+    # the transformation relative to the parent, and the parent's transformation it was last combined with
+    localTransformationMat = None
+    parentTransformationMat = None
+
+    # dirty flags. localDirty: this component's own transformation changed since the last update.
+    # subtreeDirty: this component or one of its descendants needs an update. Clean subtrees are skipped in update
+    localDirty = True
+    subtreeDirty = True
+    # number of active batchUpdate blocks, setters don't propagate changes while it is positive
+    batchDepth = 0
+    # FlatTransformTree this component belongs to. If set, the tree computes transformations instead of update
+    flatTree = None
+
+    # bounding spheres in world coordinates as (center, radius): of this component's Displayable, refreshed by update,
+    # and of all Displayables in this subtree, computed on demand by getSubtreeBounds once update flagged it stale.
+    # None if there is nothing to draw, infinite radius if unknown
+    worldBounds = None
+    subtreeBounds = None
+    subtreeBoundsDirty = True
+    # BVH this component is a leaf of, notified whenever worldBounds changes
+    bvh = None
+
+    # drawn with the instanced shader variant
+    instanced = False
 
     # a instance of class which inherit from Displayable
     # if this class is used as skeleton, then keep this empty
@@ -80,7 +107,7 @@ class Component:
     preRotationMat = None
     postRotationMat = None
 
-    texture = None
+    texture = None  # Texture, None for Components drawn without texture
     textureOn = False
     material = None
     renderingRouting = None
@@ -125,7 +152,6 @@ class Component:
         self.preRotationMat = np.identity(4)
         self.postRotationMat = np.identity(4)
         self.material = Material()
-        self.texture = Texture()
 
     def addChild(self, child):
         """
@@ -142,6 +168,23 @@ class Component:
         # prevent the duplicate child to be added to the self.children
         if child not in self.children:
             self.children.append(child)
+            child.parent = self
+            # the new child has never been combined with this component's transformation
+            child.markDirty()
+
+    def removeChild(self, child):
+        """
+        Detach child from this Component, the child's own subtree stays intact
+
+        :param child: The child Component to be removed
+        :type child: Component
+        :return: None
+        """
+        if child in self.children:
+            self.children.remove(child)
+            child.parent = None
+            # bounds of this subtree shrink
+            self.markSubtreeDirty()
 
     def clear(self):
         """
@@ -150,6 +193,7 @@ class Component:
         for c in self.children:
             c.clear()
             self.children.remove(c)
+            c.parent = None
             del c
 
     def initialize(self):
@@ -161,6 +205,8 @@ class Component:
         """
         if isinstance(self.displayObj, Displayable):
             self.displayObj.initialize()
+        if self.texture is not None:
+            self.texture.upload()
 
         for c in self.children:
             c.initialize()
@@ -168,49 +214,296 @@ class Component:
         # use init value to generate transformation matrix for all children
         self.update()
 
-    def draw(self, shaderProg):
+    def release(self):
+        """
+        Free GPU resources of this component and all its children. They cannot be drawn afterwards
+
+        :return: None
+        """
         if isinstance(self.displayObj, Displayable):
-            shaderProg.setMat4("modelMat", self.transformationMat)
-            shaderProg.setVec4("diffuse", self.material.diffuse)
-            shaderProg.setVec4("specular", self.material.specular)
-            shaderProg.setVec4("ambient", self.material.ambient)
-            shaderProg.setFloat("highlight", self.material.highLight)
-            shaderProg.setFragmentShaderRouting(self.renderingRouting)
-            if self.textureOn:
-                shaderProg.use()
-                self.texture.bind(shaderProg.getUniformLocation("textureImage"))
-            else:
-                shaderProg.use()
-                self.texture.unbind(shaderProg.getUniformLocation("textureImage"))
-            self.displayObj.draw()
+            self.displayObj.release()
+        self.releaseTexture()
+        for c in self.children:
+            c.release()
+
+    def releaseTexture(self):
+        """
+        Give a shared texture back to TextureCache, or delete a texture of this Component only
+        """
+        if self.texture is None:
+            return
+        if self.texture.key is not None:
+            TextureCache.release(self.texture)
+        else:
+            self.texture.delete()
+        self.texture = None
+
+    def draw(self, shaderProg, camera=None):
+        """
+        Draw this component and all its children
+
+        :param camera: current camera. If it is given, subtrees outside of its view frustum are skipped, and curved
+                       Displayables choose their level of detail from their size on screen
+        :type camera: Camera
+        """
+        if camera is not None and not self.subtreeVisible(camera):
+            return
+        if isinstance(self.displayObj, Displayable) and self.visible(camera):
+            self.selectLod(camera)
+            self.drawSelf(shaderProg)
 
         for c in self.children:
-            c.draw(shaderProg)
+            c.draw(shaderProg, camera)
+
+    def collect(self, renderQueue, camera=None):
+        """
+        Add this component and all its children to renderQueue, which draws them later in state-sorted order
+
+        :type renderQueue: RenderQueue
+        :type camera: Camera
+        """
+        if camera is not None and not self.subtreeVisible(camera):
+            return
+        if isinstance(self.displayObj, Displayable) and self.visible(camera):
+            self.selectLod(camera)
+            renderQueue.add(self)
+
+        for c in self.children:
+            c.collect(renderQueue, camera)
+
+    def visible(self, camera):
+        """
+        :return: False if this component's Displayable is entirely outside of camera's view frustum
+        :rtype: bool
+        """
+        return camera is None or self.worldBounds is None or camera.sphereVisible(*self.worldBounds)
+
+    def subtreeVisible(self, camera):
+        """
+        :return: False if every Displayable in this subtree is outside of camera's view frustum
+        :rtype: bool
+        """
+        bounds = self.getSubtreeBounds()
+        return bounds is None or camera.sphereVisible(*bounds)
+
+    def getSubtreeBounds(self):
+        """
+        Bounding sphere of all Displayables in this subtree. Only hierarchical culling needs it, so it is recomputed
+        here when asked for, and frames culled through a BVH never pay for it
+        """
+        if self.subtreeBoundsDirty:
+            self.subtreeBounds = self.enclosingBounds()
+            self.subtreeBoundsDirty = False
+        return self.subtreeBounds
+
+    def selectLod(self, camera):
+        """
+        Choose the level of detail of this component's Displayable from its size on screen
+        """
+        if camera is None or not self.displayObj.lodMeshes:
+            return
+        bounds = self.worldBounds if self.worldBounds is not None else self.worldBoundingSphere()
+        # no bounds means nothing to draw, e.g. an InstancedComponent without instances
+        if bounds is not None:
+            self.displayObj.selectLodByPixelRadius(camera.pixelRadius(*bounds))
+
+    def drawSelf(self, shaderProg):
+        """
+        Draw this component's Displayable only
+        """
+        self.applyDrawState(shaderProg)
+        self.displayObj.draw()
+
+    def applyDrawState(self, shaderProg, instanced=False):
+        """
+        Set transformation, material, routing and texture of this component in shaderProg
+
+        :param instanced: select the shader variant reading per-instance attributes
+        :type instanced: bool
+        """
+        shaderProg.setMat4("modelMat", self.transformationMat)
+        shaderProg.setMat3("normalMat", self.normalMat)
+        shaderProg.setVec4("diffuse", self.material.diffuse)
+        shaderProg.setVec4("specular", self.material.specular)
+        shaderProg.setVec4("ambient", self.material.ambient)
+        shaderProg.setFloat("highlight", self.material.highLight)
+        shaderProg.setFragmentShaderRouting(self.renderingRouting, instanced)
+        # the sampler uniform only changes when the texture has to move to another unit, or between draws with and
+        # without texture
+        if self.textureOn and self.texture is not None:
+            shaderProg.setInt("textureImage", self.texture.bind())
+        else:
+            shaderProg.setInt("textureImage", 0)
+
+    def worldBoundingSphere(self):
+        """
+        Bounding sphere of this component's Displayable in world coordinates
+
+        :return: center as a (3, ) ndarray, and radius
+        """
+        if not self.displayObj.meshes():
+            return np.zeros(3), math.inf
+        center, radius = self.displayObj.boundingSphere()
+        # matrix is column-major, so the point is multiplied from the left
+        worldCenter = np.append(center, 1) @ self.transformationMat
+        # scaling is uniform, any axis gives the scale factor
+        scale = np.linalg.norm(self.transformationMat[0, 0:3])
+        return worldCenter[0:3], radius * scale
+
+    def intersectRay(self, origin, direction):
+        """
+        Intersect a ray with the triangles of this component's Displayable. The ray is transformed into the
+        Displayable's coordinates, instead of transforming its vertices into world coordinates
+
+        :param origin: ray origin in world coordinates
+        :param direction: normalized ray direction in world coordinates
+        :return: distance from origin to the nearest hit, None if the ray misses
+        """
+        meshes = self.displayObj.meshes() if self.displayObj is not None else []
+        if not meshes:
+            return None
+        inverse = np.linalg.inv(self.transformationMat)
+        localOrigin = np.append(origin, 1) @ inverse
+        localDirection = np.append(direction, 0) @ inverse
+        # test the finest level of detail, whichever level is drawn
+        hit = meshes[0].intersectRay(localOrigin[0:3], localDirection[0:3])
+        # the ray parameter is invariant under affine transformations
+        return None if hit is None else hit[0]
 
     def update(self, parentTransformationMat=None):
         """
         Apply translation, rotation and scaling to this component and all its children
         all matrix are stored in column-major order
-        Must be called after any changes made to the instance
+        Only components marked dirty, and components whose parent transformation changed, are recomputed.
 
+        :param parentTransformationMat: parent's transformation. If not given, reuse the one from the last update
         :return: None
         """
+        if self.flatTree is not None:
+            self.flatTree.update(parentTransformationMat)
+            return
         if parentTransformationMat is None:
-            parentTransformationMat = np.identity(4)
+            if self.parentTransformationMat is None:
+                parentTransformationMat = np.identity(4)
+            else:
+                parentTransformationMat = self.parentTransformationMat
+        parentChanged = self.parentTransformationMat is None or \
+            (parentTransformationMat is not self.parentTransformationMat and
+             not np.array_equal(parentTransformationMat, self.parentTransformationMat))
+        changedComponents = []
+        self.propagate(parentTransformationMat, parentChanged, changedComponents)
+        # normal matrices of all changed components are computed in one batch
+        if changedComponents:
+            normalMats = GLUtility.normalMatrices([c.transformationMat for c in changedComponents])
+            for c, normalMat in zip(changedComponents, normalMats):
+                c.normalMat = normalMat
+
+    def propagate(self, parentTransformationMat, parentChanged, changedComponents):
+        """
+        Recompute dirty transformations in this subtree
 
-        translationMat = self.glUtility.translate(*self.currentPos.getCoords())
-        rotationMatU = self.glUtility.rotate(self.uAngle, self.uAxis)
-        rotationMatV = self.glUtility.rotate(self.vAngle, self.vAxis)
-        rotationMatW = self.glUtility.rotate(self.wAngle, self.wAxis)
-        scalingMat = self.glUtility.scale(*(min(self.currentScaling) * np.ones(3)))
+        :param parentTransformationMat: parent's transformation
+        :param parentChanged: whether parentTransformationMat differs from the one used in the last update
+        :type parentChanged: bool
+        :param changedComponents: components with a Displayable whose transformation changed are appended here
+        :type changedComponents: list
+        """
+        changed = parentChanged
+        if self.localDirty:
+            translationMat = self.glUtility.translate(*self.currentPos.getCoords())
+            rotationMatU = self.glUtility.rotate(self.uAngle, self.uAxis)
+            rotationMatV = self.glUtility.rotate(self.vAngle, self.vAxis)
+            rotationMatW = self.glUtility.rotate(self.wAngle, self.wAxis)
+            scalingMat = self.glUtility.scale(*(min(self.currentScaling) * np.ones(3)))
+
+            # remember that all above matrix are store in column-major, which is the transpose of row-major
+            # be careful about the applying order
+            self.localTransformationMat = scalingMat @ self.preRotationMat @ rotationMatW @ rotationMatV @ \
+                                          rotationMatU @ self.postRotationMat @ translationMat
+            self.localDirty = False
+            changed = True
+
+        if changed:
+            self.parentTransformationMat = parentTransformationMat
+            self.transformationMat = self.localTransformationMat @ parentTransformationMat
+            if self.displayObj is not None:
+                changedComponents.append(self)
+                self.worldBounds = self.worldBoundingSphere()
+                if self.bvh is not None:
+                    self.bvh.markMoved(self)
+
+        if changed or self.subtreeDirty:
+            for c in self.children:
+                if c.flatTree is not None:
+                    # a flattened subtree below a regular parent, its tree keeps worldMats and transformationMat shared
+                    c.flatTree.update(self.transformationMat)
+                else:
+                    c.propagate(self.transformationMat, changed, changedComponents)
+            self.subtreeBoundsDirty = True
+        self.subtreeDirty = False
+
+    def enclosingBounds(self):
+        """
+        :return: a bounding sphere of this component's and its children's bounds, None if none of them has one
+        """
+        spheres = [bounds for bounds in (c.getSubtreeBounds() for c in self.children) if bounds is not None]
+        if self.worldBounds is not None:
+            spheres.append(self.worldBounds)
+        if not spheres:
+            return None
+        if len(spheres) == 1:
+            return spheres[0]
+        return GLUtility.enclosingSphere([center for center, _ in spheres], [radius for _, radius in spheres])
+
+    def markDirty(self):
+        """
+        Flag this component's transformation as changed, it will be recomputed in the next update.
+        Call this after modifying transformation attributes directly instead of through setters.
+        """
+        if self.flatTree is not None:
+            self.flatTree.markComponentDirty(self)
+            # the tree may be flattened below regular Components, whose update must visit it
+            if self.flatTree.root.parent is not None:
+                self.flatTree.root.parent.markSubtreeDirty()
+            return
+        self.localDirty = True
+        self.markSubtreeDirty()
+
+    def markSubtreeDirty(self):
+        """
+        Flag this component and its ancestors to be visited in the next update, without changing any transformation
+        """
+        self.subtreeDirty = True
+        node = self.parent
+        # a dirty subtree always has dirty ancestors, so we can stop at the first one already flagged
+        while node is not None and not node.subtreeDirty:
+            node.subtreeDirty = True
+            node = node.parent
+
+    def transformationChanged(self):
+        """
+        Mark dirty and propagate immediately, unless we are inside of batchUpdate or a FlatTransformTree owns this component
+        """
+        self.markDirty()
+        if Component.batchDepth == 0 and self.flatTree is None:
+            self.update()
 
-        # remember that all above matrix are store in column-major, which is the transpose of row-major
-        # be careful about the applying order
-        self.transformationMat = scalingMat @ self.preRotationMat @ rotationMatW @ rotationMatV @ rotationMatU @ \
-                                 self.postRotationMat @ translationMat @ parentTransformationMat
+    @contextlib.contextmanager
+    def batchUpdate(self):
+        """
+        Context manager to change many transformations with a single propagation at its end, e.g.
 
-        for c in self.children:
-            c.update(self.transformationMat)
+            with scene.batchUpdate():
+                a.setCurrentPosition(p)
+                b.setCurrentAngle(30, b.uAxis)
+        """
+        Component.batchDepth += 1
+        try:
+            yield self
+        finally:
+            Component.batchDepth -= 1
+            if Component.batchDepth == 0:
+                self.update()
 
     def rotate(self, angle, axis):
         """
@@ -249,6 +542,7 @@ class Component:
             self.setU([1, 0, 0])
             self.setV([0, 1, 0])
             self.setW([0, 0, 1])
+        self.markDirty()
 
     def setRotateExtent(self, axis, minDeg=None, maxDeg=None):
         """
@@ -302,10 +596,11 @@ class Component:
         if not os.path.isfile(imgFilePath):
             raise TypeError("Image File doesn't exist")
 
-        shaderProg.use()
-        texture_image = Image.open(imgFilePath).convert("RGB")
-        texture_image = np.array(texture_image, dtype=np.uint8)
-        self.texture.setTextureImage(texture_image)
+        # shared with every Component showing the same image, and decoded only once. The GL texture is created on
+        # initialize, so scenes can be constructed off the GL thread
+        texture = TextureCache.acquire(imgFilePath)
+        self.releaseTexture()
+        self.texture = texture
         self.textureOn = textureOn
 
     def setMaterial(self, material: Material):
@@ -327,7 +622,7 @@ class Component:
             self.vAngle = self.clamp(angle, self.vRange[0], self.vRange[1])
         else:
             self.wAngle = self.clamp(angle, self.wRange[0], self.wRange[1])
-        self.update()
+        self.transformationChanged()
 
     def setDefaultAngle(self, angle, axis):
         """
@@ -348,6 +643,7 @@ class Component:
         else:
             self.default_wAngle = angle
             self.wAngle = angle
+        self.markDirty()
 
     def setDefaultPosition(self, pos):
         """
@@ -360,6 +656,7 @@ class Component:
             raise TypeError("pos should have type Point")
         self.defaultPos = pos.copy()
         self.currentPos = copy.deepcopy(self.defaultPos)
+        self.markDirty()
 
     def setDefaultScale(self, scale):
         """
@@ -375,7 +672,7 @@ class Component:
             raise ValueError("Component only accept uniform scaling")
         self.defaultScaling = copy.deepcopy(scale)
         self.currentScaling = copy.deepcopy(self.defaultScaling)
-        self.update()
+        self.transformationChanged()
 
     def setCurrentPosition(self, pos):
         """
@@ -387,7 +684,7 @@ class Component:
         if not isinstance(pos, Point):
             raise TypeError("pos should have type Point")
         self.currentPos = pos.copy()
-        self.update()
+        self.transformationChanged()
 
     def setCurrentScale(self, scale):
         """
@@ -402,7 +699,7 @@ class Component:
         if min(scale) != max(scale):
             raise ValueError("Component only accept uniform scaling")
         self.currentScaling = copy.deepcopy(scale)
-        self.update()
+        self.transformationChanged()
 
     def changeRotationAxis(self, u, v, w):
         """
@@ -434,6 +731,7 @@ class Component:
         self.uAngle = 0
         self.vAngle = 0
         self.wAngle = 0
+        self.markDirty()
 
     def setPreRotation(self, rotation_matrix=None):
         """
@@ -445,6 +743,7 @@ class Component:
         """
         if isinstance(rotation_matrix, np.ndarray):
             self.preRotationMat = rotation_matrix
+            self.markDirty()
 
     def u(self):
         return self.uAxis.copy()
@@ -460,15 +759,18 @@ class Component:
             raise TypeError("axis should have the same size as the current one")
         for i in range(len(u)):
             self.uAxis[i] = u[i]
+        self.markDirty()
 
     def setV(self, v):
         if len(v) != len(self.vAxis):
             raise TypeError("axis should have the same size as the current one")
         for i in range(len(v)):
             self.vAxis[i] = v[i]
+        self.markDirty()
 
     def setW(self, w):
         if len(w) != len(self.wAxis):
             raise TypeError("axis should have the same size as the current one")
         for i in range(len(w)):
             self.wAxis[i] = w[i]
+        self.markDirty()
@@ -5,12 +5,41 @@ First version in 09/26/2018
 :author: micou(Zezhou Sun)
 :version: 2021.1.1
 """
+import math
+
+from GeometryCache import GeometryCache
+from MeshCache import MeshCache
+
+
+def lodTessellations(tessellation, levelNum=3, minimum=8):
+    """
+    Tessellation of every level in a LOD chain, halved from level to level
+
+    :param tessellation: tessellation of the finest level
+    :type tessellation: int
+    :return: tessellations from the finest level to the coarsest level
+    :rtype: list<int>
+    """
+    result = [tessellation]
+    for _ in range(levelNum - 1):
+        coarser = max(minimum, result[-1] // 2)
+        if coarser >= result[-1]:
+            break
+        result.append(coarser)
+    return result
 
 
 class Displayable:
     """
     Interface for displayable object
     """
+    mesh = None  # GLMesh shared with all identical Displayables, the one to draw
+    persistentMesh = False  # keep generated meshes in MeshCache, worth it for tessellated primitives
+
+    lodMeshes = None  # list<GLMesh>, level of detail chain from the finest mesh to the coarsest mesh
+    lodSegments = None  # list<int>, number of segments along the longest circumference on every LOD level
+    lodPixelError = 8  # longest screen space edge in pixels we accept before switching to a finer level
+
     def __init__(self):
         pass
 
@@ -19,3 +48,104 @@ class Displayable:
 
     def initialize(self):
         raise NotImplementedError
+
+    def generate(self, *args):
+        raise NotImplementedError
+
+    def acquireMesh(self, parameters, *generateArgs):
+        """
+        Get the shared mesh for this Displayable from GeometryCache. generate is only called if no identical mesh
+        exists yet, and, for persistentMesh Displayables, if the mesh isn't in the on-disk MeshCache either.
+
+        :param parameters: all constructor parameters which affect the mesh, beside generate arguments
+        :type parameters: tuple
+        :param generateArgs: arguments passed to generate
+        """
+        key = (type(self).__name__, *parameters, *generateArgs)
+
+        def build():
+            if self.persistentMesh:
+                cached = MeshCache.load(key)
+                if cached is not None:
+                    return cached
+            self.generate(*generateArgs)
+            if self.persistentMesh:
+                MeshCache.store(key, self.vertices, self.indices)
+            return self.vertices, self.indices
+
+        self.mesh = GeometryCache.acquire(key, build)
+        # the local bounding sphere is computed once here, drawing only transforms it
+        self.mesh.boundingSphere()
+        self.vertices = self.mesh.vertices
+        self.indices = self.mesh.indices
+
+    def acquireLodMeshes(self, parameters, levels, segments):
+        """
+        Get shared meshes for a chain of tessellation levels. The finest level is selected by default, and its vertices
+        and indices are kept in self.vertices and self.indices
+
+        :param parameters: all constructor parameters which affect the mesh, beside generate arguments
+        :type parameters: tuple
+        :param levels: generate arguments of every level, from the finest level to the coarsest level
+        :type levels: list<tuple>
+        :param segments: number of segments along the longest circumference on every level
+        :type segments: list<int>
+        """
+        self.lodMeshes = []
+        for generateArgs in levels:
+            self.acquireMesh(parameters, *generateArgs)
+            self.lodMeshes.append(self.mesh)
+        self.lodSegments = segments
+        self.selectLod(0)
+
+    def selectLod(self, level):
+        """
+        Choose which LOD level to draw
+
+        :param level: index in the LOD chain, 0 is the finest level
+        :type level: int
+        """
+        self.mesh = self.lodMeshes[level]
+        self.vertices = self.lodMeshes[0].vertices
+        self.indices = self.lodMeshes[0].indices
+
+    def selectLodByPixelRadius(self, pixelRadius):
+        """
+        Choose the coarsest LOD level whose edges along the longest circumference are still shorter than
+        lodPixelError on screen
+
+        :param pixelRadius: radius of this Displayable's bounding sphere projected on screen, in pixels
+        :type pixelRadius: float
+        """
+        if not self.lodMeshes:
+            return
+        level = 0
+        for i, segments in enumerate(self.lodSegments):
+            if 2 * math.pi * pixelRadius / segments <= self.lodPixelError:
+                level = i
+        if self.mesh is not self.lodMeshes[level]:
+            self.selectLod(level)
+
+    def meshes(self):
+        """
+        :return: all meshes this Displayable might draw
+        :rtype: list<GLMesh>
+        """
+        if self.lodMeshes:
+            return self.lodMeshes
+        return [] if self.mesh is None else [self.mesh]
+
+    def boundingSphere(self):
+        """
+        :return: center and radius of a sphere containing this Displayable, in local coordinates
+        """
+        return self.meshes()[0].boundingSphere()
+
+    def release(self):
+        """
+        Give shared meshes back to GeometryCache. This Displayable cannot be drawn afterwards.
+        """
+        for mesh in self.meshes():
+            GeometryCache.release(mesh)
+        self.mesh = None
+        self.lodMeshes = None
@@ -7,7 +7,6 @@ First version in 10/20/2021
 """
 
 from Displayable import Displayable
-from GLBuffer import VAO, VBO, EBO
 import numpy as np
 import ColorType
 
@@ -38,9 +37,6 @@ except ImportError:
 
 
 class DisplayableCube(Displayable):
-    vao = None
-    vbo = None
-    ebo = None
     shaderProg = None
 
     vertices = None  # array to store vertices information
@@ -55,13 +51,12 @@ class DisplayableCube(Displayable):
     def __init__(self, shaderProg, length=1, width=1, height=1, color=ColorType.BLUE):
         super(DisplayableCube, self).__init__()
         self.shaderProg = shaderProg
-        self.shaderProg.use()
 
-        self.vao = VAO()
-        self.vbo = VBO()  # vbo can only be initiate with glProgram activated
-        self.ebo = EBO()
-
-        self.generate(length, width, height, color)
+        self.length = length
+        self.width = width
+        self.height = height
+        self.color = color
+        self.acquireMesh((), length, width, height, color)
 
     def generate(self, length=1, width=1, height=1, color=None):
         self.length = length
@@ -125,36 +120,16 @@ class DisplayableCube(Displayable):
             20, 21, 22,
             20, 22, 23,
         ])
-        self.vertices = v_arr
+        self.vertices = v_arr.reshape(-1, 11)
         self.indices = e_arr
 
 
     def draw(self):
-        # self.vao.bind()
-        # # TODO 1.1 is at here, switch from vbo to ebo
-        # self.vbo.draw()
-        # self.vao.unbind()
-
-        self.vao.bind()
-        self.ebo.draw()
-        self.vao.unbind()
+        self.mesh.draw()
 
     def initialize(self):
         """
-        Remember to bind VAO before this initialization. If VAO is not bind, program might throw an error
-        in systems that don't enable a default VAO after GLProgram compilation
+        Upload meshes to GPU. A mesh shared with other Displayables is only uploaded once
         """
-        self.vao.bind()
-        self.vbo.setBuffer(self.vertices, 11)
-        self.ebo.setBuffer(self.indices)
-
-        self.vbo.setAttribPointer(self.shaderProg.getAttribLocation("vertexPos"),
-                                  stride=11, offset=0, attribSize=3)
-        self.vbo.setAttribPointer(self.shaderProg.getAttribLocation("vertexNormal"),
-                                  stride=11, offset=3, attribSize=3)
-        self.vbo.setAttribPointer(self.shaderProg.getAttribLocation("vertexColor"),
-                                  stride=11, offset=6, attribSize=3)
-        # TODO/BONUS 6.1 is at here, you need to set attribPointer for texture coordinates
-        # you should check the corresponding variable name in GLProgram and set the pointer
-        self.vao.unbind()
-
+        for mesh in self.meshes():
+            mesh.initialize(self.shaderProg)
@@ -6,8 +6,8 @@ First version in 11/01/2021
 :version: 2021.1.1
 """
 
-from Displayable import Displayable
-from GLBuffer import VAO, VBO, EBO
+from Displayable import Displayable, lodTessellations
+from ParametricSurface import ParametricSurface
 from Point import Point
 import numpy as np
 import ColorType
@@ -48,10 +48,8 @@ except ImportError:
 
 # DisplayableTorus(innerRadius, outerRadius, nsides, rings)
 class DisplayableTorus(Displayable):
-    vao = None
-    vbo = None
-    ebo = None
     shaderProg = None
+    persistentMesh = True
 
     # stores current torus's information, read-only
     nsides = 0
@@ -66,11 +64,6 @@ class DisplayableTorus(Displayable):
     def __init__(self, shaderProg, innerRadius=0.25, outerRadius=0.5, nsides=36, rings=36, color=ColorType.SOFTBLUE):
         super(DisplayableTorus, self).__init__()
         self.shaderProg = shaderProg
-        self.shaderProg.use()
-
-        self.vao = VAO()
-        self.vbo = VBO()  # vbo can only be initiate with glProgram activated
-        self.ebo = EBO()
 
         self.nsides = nsides
         self.rings = rings
@@ -78,90 +71,40 @@ class DisplayableTorus(Displayable):
         self.outerRadius = outerRadius
         self.color = color
 
-        self.generate()
+        levels = list(zip(lodTessellations(nsides), lodTessellations(rings)))
+        self.acquireLodMeshes((innerRadius, outerRadius, tuple(color)), levels,
+                              [levelRings for _, levelRings in levels])
 
-    def generate(self):
+    def generate(self, nsides, rings):
         r = self.innerRadius
         R = self.outerRadius
-        stacks = self.rings
-        slices = self.nsides
-
-        v_arr = []
-        e_arr = []
-
-        # mesh
-        for theta in np.linspace(-np.pi, np.pi, stacks):
-            for phi in np.linspace(-np.pi, np.pi, slices):
-                x = (R + r*np.cos(phi)) * np.cos(theta)
-                y = (R + r*np.cos(phi)) * np.sin(theta)
-                z = r * np.sin(phi)
-                # nx = -r*np.sin(phi)*np.sin(theta) - r*(R + r*np.cos(phi))*np.cos(theta)*np.cos(theta)
-                # ny = -r*np.sin(phi)*np.cos(theta) + r*(R + r*np.cos(phi))*np.sin(theta)*np.cos(theta)
-                # nz = -r*(R + r*np.cos(phi))*np.sin(phi)*np.cos(theta)*np.cos(theta) + r*(R + r*np.cos(phi))*np.sin(phi)*np.cos(theta)*np.cos(theta)
-                nx = 2*(np.sqrt(x**2+y**2) - R) * x / np.sqrt(x**2+y**2)
-                ny = 2*(np.sqrt(x**2+y**2) - R) * y / np.sqrt(x**2+y**2)
-                nz = 2*z
-                normal = np.array([nx, ny, nz])
-                normal = normal / np.linalg.norm(normal)
-                nx, ny, nz = normal
-                u = (theta + np.pi)/(2*np.pi)
-                v = (phi + np.pi/2)/np.pi
-                P_u_x = -(R + r*np.cos(phi)) * np.sin(theta)
-                P_u_y = (R + r*np.cos(phi)) * np.cos(theta)
-                P_u_z = 1
-                P_v_x = -r*np.sin(phi) * np.cos(theta)
-                P_v_y = -r*np.sin(phi) * np.sin(theta)
-                P_v_z = r*np.cos(phi)
-                v_arr.append([x, y, z, nx, ny, nz, self.color.r, self.color.g, self.color.b, u, v, P_u_x, P_u_y, P_u_z, P_v_x, P_v_y, P_v_z])
-
-        # ebo
-        e_arr = []
-        for stack in range(stacks):
-            for slice in range(slices):
-                next_stack = (stack + 1) % stacks
-                next_slice = (slice + 1) % slices
-                # e_arr.append([*v_arr[stack][slice], *np.random.rand(3), 0, 0])
-                # e_arr.append([*v_arr[next_stack][slice], *np.random.rand(3), 0, 0])
-                # e_arr.append([*v_arr[stack][next_slice], *np.random.rand(3), 0, 0])
-
-                # e_arr.append([*v_arr[stack][next_slice], *np.random.rand(3), 0, 0])
-                # e_arr.append([*v_arr[next_stack][slice], *np.random.rand(3), 0, 0])
-                # e_arr.append([*v_arr[next_stack][next_slice], *np.random.rand(3), 0, 0])
-                e_arr.append(stack * slices + slice)
-                e_arr.append(next_stack * slices + slice)
-                e_arr.append(stack * slices + next_slice)
-                e_arr.append(stack * slices + next_slice)
-                e_arr.append(next_stack * slices + slice)
-                e_arr.append(next_stack * slices + next_slice)
-
-
-        self.vertices = np.array(v_arr)
-        self.indices = np.array(e_arr)
+
+        def position(theta, phi):
+            return (R + r*np.cos(phi)) * np.cos(theta), (R + r*np.cos(phi)) * np.sin(theta), r * np.sin(phi)
+
+        def normal(theta, phi):
+            # gradient of (sqrt(x^2 + y^2) - R)^2 + z^2 - r^2
+            x, y, z = position(theta, phi)
+            d = np.sqrt(x**2 + y**2)
+            return 2*(d - R) * x / d, 2*(d - R) * y / d, 2*z
+
+        def texture(theta, phi):
+            return (theta + np.pi)/(2*np.pi), (phi + np.pi/2)/np.pi
+
+        def tangent(theta, phi):
+            return (-(R + r*np.cos(phi)) * np.sin(theta), (R + r*np.cos(phi)) * np.cos(theta), np.ones_like(phi),
+                    -r*np.sin(phi) * np.cos(theta), -r*np.sin(phi) * np.sin(theta), r*np.cos(phi))
+
+        # torus is closed along both directions
+        surface = ParametricSurface([-np.pi, np.pi], [-np.pi, np.pi], rings, nsides, uWrap=True)
+        self.vertices, self.indices = surface.generate(position, normal, texture, self.color, tangent)
 
     def draw(self):
-        self.vao.bind()
-        self.ebo.draw()
-        self.vao.unbind()
+        self.mesh.draw()
 
     def initialize(self):
         """
-        Remember to bind VAO before this initialization. If VAO is not bind, program might throw an error
-        in systems which don't enable a default VAO after GLProgram compilation
+        Upload meshes to GPU. A mesh shared with other Displayables is only uploaded once
         """
-        self.vao.bind()
-        self.vbo.setBuffer(self.vertices, 17)
-        self.ebo.setBuffer(self.indices)
-
-        self.vbo.setAttribPointer(self.shaderProg.getAttribLocation("vertexPos"),
-                                  stride=17, offset=0, attribSize=3)
-        self.vbo.setAttribPointer(self.shaderProg.getAttribLocation("vertexNormal"),
-                                  stride=17, offset=3, attribSize=3)
-        self.vbo.setAttribPointer(self.shaderProg.getAttribLocation("vertexColor"),
-                                  stride=17, offset=6, attribSize=3)
-        self.vbo.setAttribPointer(self.shaderProg.getAttribLocation("vertexTexture"),
-                                  stride=17, offset=9, attribSize=2)
-        self.vbo.setAttribPointer(self.shaderProg.getAttribLocation("vertexT"),
-                                  stride=17, offset=11, attribSize=3)
-        self.vbo.setAttribPointer(self.shaderProg.getAttribLocation("vertexB"),
-                                  stride=17, offset=14, attribSize=3)
-        self.vao.unbind()
+        for mesh in self.meshes():
+            mesh.initialize(self.shaderProg)
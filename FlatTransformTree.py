@@ -0,0 +1,266 @@
+"""
+Define an array-backed representation of a Component tree here. All transformation state is kept in contiguous
+numpy arrays in topological order, and world transformations are computed level by level with batched matrix
+multiplications instead of a recursion over every Component.
+
+:author: micou(Zezhou Sun)
+:version: 2021.1.1
+"""
+import math
+
+import numpy as np
+
+from GLUtility import GLUtility
+
+
+def batchRotate(angles, axes):
+    """
+    Vectorized GLUtility.rotate, returns column-major rotation matrices
+
+    :param angles: rotation angles in degs, in shape (n, )
+    :param axes: rotation axes, in shape (n, 3)
+    :return: rotation matrices in shape (n, 4, 4)
+    """
+    halfAngles = np.asarray(angles, dtype=np.float64) / 180 * math.pi * 0.5
+    q = np.empty((len(halfAngles), 4))
+    q[:, 0] = np.cos(halfAngles)
+    q[:, 1:4] = np.sin(halfAngles)[:, None] * axes
+    norm = np.sqrt(np.sum(q**2, axis=1))
+    degenerate = norm < 1e-6
+    q[~degenerate] /= norm[~degenerate, None]
+    s, a, b, c = q.T
+
+    # built directly in column-major, which is the transpose of GLUtility.rotate's row-major matrix
+    result = np.zeros((len(halfAngles), 4, 4))
+    result[:, 0, 0] = 1 - 2 * b * b - 2 * c * c
+    result[:, 0, 1] = 2 * a * b + 2 * s * c
+    result[:, 0, 2] = 2 * a * c - 2 * s * b
+    result[:, 1, 0] = 2 * a * b - 2 * s * c
+    result[:, 1, 1] = 1 - 2 * a * a - 2 * c * c
+    result[:, 1, 2] = 2 * b * c + 2 * s * a
+    result[:, 2, 0] = 2 * a * c + 2 * s * b
+    result[:, 2, 1] = 2 * b * c - 2 * s * a
+    result[:, 2, 2] = 1 - 2 * a * a - 2 * b * b
+    result[:, 3, 3] = 1
+    result[degenerate] = np.identity(4)
+    return result
+
+
+class FlatTransformTree:
+    """
+    Flat transformation hierarchy of a Component tree.
+
+    Component i in topological order (parents always before their children) owns row i of every array:
+        * parents: (n, ) parent index, -1 for the root
+        * positions: (n, 3) translation relative to the parent
+        * angles: (n, 3) rotation angles along u, v and w axis, in degs
+        * axes: (n, 3, 3) u, v and w rotation axis
+        * scales: (n, ) uniform scaling
+        * preRotations, postRotations: (n, 4, 4)
+        * localMats, worldMats: (n, 4, 4) float32, column-major like everywhere else
+        * normalMats: (n, 3, 3) float32, normal matrices of worldMats
+
+    After build, every Component's transformationMat is a view into worldMats, so drawing the Component tree
+    directly uses the transformations computed here. Component setters copy their new parameters into the arrays
+    and leave the propagation to the next update, which is also what Component.update forwards to. For bulk
+    animation, change rows of the parameter arrays directly and call markDirty. Call update once per frame.
+
+    The root may have a regular parent Component. Its update then forwards to this tree with its own transformation.
+    """
+    root = None  # Component
+    rootParentMat = None
+    components = None  # list<Component>
+    componentIndex = None  # dict<int, int>, id(component) -> row
+    levels = None  # list<ndarray>, rows of every tree depth
+
+    parents = None
+    positions = None
+    angles = None
+    axes = None
+    scales = None
+    preRotations = None
+    postRotations = None
+    localMats = None
+    worldMats = None
+    normalMats = None
+    dirty = None  # (n, ) bool, rows whose local transformation needs to be rebuilt
+    staleComponents = None  # set<int>, rows whose Component changed, copied into the arrays on the next update
+    drawableRows = None  # rows of Components with a Displayable
+
+    def __init__(self, root):
+        """
+        :param root: top level component, everything below it is flattened
+        :type root: Component
+        """
+        self.build(root)
+
+    def build(self, root):
+        """
+        Flatten the Component tree below root again. Required after adding or removing Components
+        """
+        if self.root is not None:
+            self.detach()
+        self.root = root
+        self.rootParentMat = np.identity(4)
+        self.components = []
+        parents = []
+        depths = []
+        # breadth first traversal gives a topological order
+        queue = [(root, -1, 0)]
+        while queue:
+            nextQueue = []
+            for component, parent, depth in queue:
+                index = len(self.components)
+                self.components.append(component)
+                parents.append(parent)
+                depths.append(depth)
+                nextQueue.extend((c, index, depth + 1) for c in component.children)
+            queue = nextQueue
+        self.componentIndex = {id(c): i for i, c in enumerate(self.components)}
+
+        n = len(self.components)
+        self.parents = np.array(parents, dtype=np.int64)
+        depths = np.array(depths)
+        self.levels = [np.nonzero(depths == d)[0] for d in range(depths.max() + 1)]
+
+        self.positions = np.zeros((n, 3))
+        self.angles = np.zeros((n, 3))
+        self.axes = np.zeros((n, 3, 3))
+        self.scales = np.ones(n)
+        self.preRotations = np.tile(np.identity(4), (n, 1, 1))
+        self.postRotations = np.tile(np.identity(4), (n, 1, 1))
+        self.localMats = np.tile(np.identity(4, dtype=np.float32), (n, 1, 1))
+        self.worldMats = np.tile(np.identity(4, dtype=np.float32), (n, 1, 1))
+        self.normalMats = np.tile(np.identity(3, dtype=np.float32), (n, 1, 1))
+        self.dirty = np.ones(n, dtype=bool)
+        self.staleComponents = set()
+
+        self.drawableRows = np.array([i for i, c in enumerate(self.components) if c.displayObj is not None],
+                                     dtype=np.int64)
+
+        self.pull()
+        for i, component in enumerate(self.components):
+            component.flatTree = self
+            component.transformationMat = self.worldMats[i]
+            component.normalMat = self.normalMats[i]
+            # subtree bounds are not maintained here, so subtrees are never culled as a whole
+            component.subtreeBounds = None
+            component.subtreeBoundsDirty = False
+        # unknown bounds, so regular ancestors don't cull the flattened subtree either
+        root.subtreeBounds = (np.zeros(3), math.inf)
+        if root.parent is not None:
+            root.parent.markSubtreeDirty()
+        self.update()
+
+    def detach(self):
+        """
+        Hand transformations back to the Components, which are updated recursively again afterwards
+        """
+        for i, component in enumerate(self.components):
+            component.flatTree = None
+            component.transformationMat = self.worldMats[i].astype(np.float64)
+            component.normalMat = self.normalMats[i].astype(np.float64)
+            component.markDirty()
+        self.root.update(self.rootParentMat)
+        self.root = None
+
+    def index(self, component):
+        """
+        :return: row of component in all arrays
+        """
+        return self.componentIndex[id(component)]
+
+    def pullComponent(self, component):
+        """
+        Copy transformation parameters of one Component into the arrays, and mark its row dirty
+        """
+        i = self.index(component)
+        self.positions[i] = component.currentPos.getCoords()
+        self.angles[i] = (component.uAngle, component.vAngle, component.wAngle)
+        self.axes[i] = (component.uAxis.getCoords(), component.vAxis.getCoords(), component.wAxis.getCoords())
+        self.scales[i] = min(component.currentScaling)
+        self.preRotations[i] = component.preRotationMat
+        self.postRotations[i] = component.postRotationMat
+        self.dirty[i] = True
+
+    def markComponentDirty(self, component):
+        """
+        Flag a Component whose transformation attributes changed. They are only read in the next update, so callers
+        may flag before or after changing them
+        """
+        self.staleComponents.add(self.index(component))
+
+    def pull(self):
+        """
+        Copy transformation parameters of all Components into the arrays
+        """
+        for component in self.components:
+            self.pullComponent(component)
+
+    def markDirty(self, rows=None):
+        """
+        :param rows: indices or mask of rows whose parameters were changed in place, all rows if not given
+        """
+        if rows is None:
+            self.dirty[:] = True
+        else:
+            self.dirty[rows] = True
+
+    def updateLocal(self, rows):
+        """
+        Rebuild local transformations of rows, in the same order as Component.update
+        """
+        n = len(rows)
+        translations = np.tile(np.identity(4), (n, 1, 1))
+        translations[:, 3, 0:3] = self.positions[rows]
+        scalings = np.zeros((n, 4, 4))
+        scalings[:, 0, 0] = scalings[:, 1, 1] = scalings[:, 2, 2] = self.scales[rows]
+        scalings[:, 3, 3] = 1
+        rotationsU = batchRotate(self.angles[rows, 0], self.axes[rows, 0])
+        rotationsV = batchRotate(self.angles[rows, 1], self.axes[rows, 1])
+        rotationsW = batchRotate(self.angles[rows, 2], self.axes[rows, 2])
+
+        self.localMats[rows] = scalings @ self.preRotations[rows] @ rotationsW @ rotationsV @ rotationsU @ \
+                               self.postRotations[rows] @ translations
+
+    def update(self, rootParentMat=None):
+        """
+        Recompute dirty local transformations, then world transformations of every row whose own or ancestor's
+        transformation changed, one tree level at a time, and finally their normal matrices in one batch and the
+        world bounding spheres of their Displayables
+
+        :param rootParentMat: transformation of the root's parent. If not given, reuse the one from the last update
+        :return: mask of rows whose world transformation was recomputed
+        """
+        for i in self.staleComponents:
+            self.pullComponent(self.components[i])
+        self.staleComponents.clear()
+
+        changed = self.dirty.copy()
+        dirtyRows = np.nonzero(self.dirty)[0]
+        if len(dirtyRows) > 0:
+            self.updateLocal(dirtyRows)
+        self.dirty[:] = False
+
+        root = self.levels[0]
+        if rootParentMat is not None and not np.array_equal(rootParentMat, self.rootParentMat):
+            self.rootParentMat = np.array(rootParentMat, dtype=np.float64)
+            changed[root] = True
+        if changed[root].any():
+            self.worldMats[root] = self.localMats[root] @ self.rootParentMat.astype(np.float32)
+
+        for level in self.levels[1:]:
+            changed[level] |= changed[self.parents[level]]
+            rows = level[changed[level]]
+            if len(rows) > 0:
+                self.worldMats[rows] = self.localMats[rows] @ self.worldMats[self.parents[rows]]
+
+        changedRows = np.nonzero(changed)[0]
+        if len(changedRows) > 0:
+            self.normalMats[changedRows] = GLUtility.normalMatrices(self.worldMats[changedRows])
+            for i in self.drawableRows[changed[self.drawableRows]]:
+                component = self.components[i]
+                component.worldBounds = component.worldBoundingSphere()
+                if component.bvh is not None:
+                    component.bvh.markMoved(component)
+        return changed
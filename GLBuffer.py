@@ -32,6 +32,7 @@ except ImportError:
 
 import numpy as np
 import ctypes
+from collections import OrderedDict
 
 
 class VBO:
@@ -48,15 +49,20 @@ class VBO:
     # def __del__(self):
     #     gl.glDeleteBuffers(1, self.vbo)
 
+    def delete(self):
+        gl.glDeleteBuffers(1, [self.vbo])
+        self.vbo = None
+
     def bind(self):
         gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.vbo)
 
-    def setBuffer(self, bufferDataArray: np.ndarray, vertexAttribSize: int):
+    def setBuffer(self, bufferDataArray: np.ndarray, vertexAttribSize: int, dynamic=False):
         """
         :param vertexAttribSize: the size of the vertex attribute
         :type vertexAttribSize: int
         :param bufferDataArray: the vertices data. It will be flatten in row-major order if its dimension isn't one
         :type bufferDataArray: numpy.ndarray
+        :param dynamic: hint that the data will be replaced frequently
         """
         # type conversion
         if bufferDataArray.dtype != np.dtype("float32"):
@@ -69,9 +75,13 @@ class VBO:
         byteLength = 4 * bufferSize  # 4 is the size of float32
 
         self.bind()
-        gl.glBufferData(gl.GL_ARRAY_BUFFER, byteLength, bufferData, gl.GL_STATIC_DRAW)
+        gl.glBufferData(gl.GL_ARRAY_BUFFER, byteLength, bufferData,
+                        gl.GL_DYNAMIC_DRAW if dynamic else gl.GL_STATIC_DRAW)
 
-    def setAttribPointer(self, attribLoc, stride=0, offset=0, attribSize=0):
+    def setAttribPointer(self, attribLoc, stride=0, offset=0, attribSize=0, divisor=0):
+        """
+        :param divisor: 0 for per-vertex attributes, n to advance the attribute once every n instances
+        """
         attribSize = self.vertexAttribSize if attribSize == 0 else attribSize
         if attribSize == 0:
             raise Exception("Cannot set vertex attrib with empty attribSize")
@@ -87,6 +97,8 @@ class VBO:
         stride *= 4
         gl.glVertexAttribPointer(attribLoc, attribSize, gl.GL_FLOAT, gl.GL_FALSE, stride, offset)
         gl.glEnableVertexAttribArray(attribLoc)
+        if divisor:
+            gl.glVertexAttribDivisor(attribLoc, divisor)
 
     def draw(self):
         gl.glDrawArrays(gl.GL_TRIANGLES, 0, self.vertexNum)
@@ -106,6 +118,10 @@ class EBO:
     # def __del__(self):
     #     gl.glDeleteBuffers(1, self.ebo)
 
+    def delete(self):
+        gl.glDeleteBuffers(1, [self.ebo])
+        self.ebo = None
+
     def bind(self):
         gl.glBindBuffer(gl.GL_ELEMENT_ARRAY_BUFFER, self.ebo)
 
@@ -124,6 +140,9 @@ class EBO:
     def draw(self):
         gl.glDrawElements(gl.GL_TRIANGLES, self.indexNum, gl.GL_UNSIGNED_INT, None)
 
+    def drawInstanced(self, instanceNum):
+        gl.glDrawElementsInstanced(gl.GL_TRIANGLES, self.indexNum, gl.GL_UNSIGNED_INT, None, instanceNum)
+
 
 class VAO:
     """
@@ -137,6 +156,10 @@ class VAO:
     # def __del__(self):
     #     gl.glDeleteVertexArrays(1, self.vao)
 
+    def delete(self):
+        gl.glDeleteVertexArrays(1, [self.vao])
+        self.vao = None
+
     def bind(self):
         gl.glBindVertexArray(self.vao)
 
@@ -144,38 +167,117 @@ class VAO:
         gl.glBindVertexArray(0)
 
 
-# A global variable in this scope to store next texture id, there should be no duplicate textureUnitID
-NextTextureID = 1
+class UBO:
+    """
+    A class to handle uniform buffer object in OpenGL, with some help functions
+    """
+    ubo = None
+    byteLength = 0
+
+    def __init__(self):
+        self.ubo = gl.glGenBuffers(1)
+
+    def delete(self):
+        gl.glDeleteBuffers(1, [self.ubo])
+        self.ubo = None
+
+    def bind(self):
+        gl.glBindBuffer(gl.GL_UNIFORM_BUFFER, self.ubo)
+
+    def bindBase(self, bindingPoint):
+        """
+        Attach this buffer to a uniform block binding point
+        """
+        gl.glBindBufferBase(gl.GL_UNIFORM_BUFFER, bindingPoint, self.ubo)
+
+    def setBuffer(self, bufferDataArray: np.ndarray):
+        """
+        :param bufferDataArray: raw buffer content, already laid out as the uniform block expects
+        """
+        self.byteLength = bufferDataArray.nbytes
+        self.bind()
+        gl.glBufferData(gl.GL_UNIFORM_BUFFER, self.byteLength, bufferDataArray, gl.GL_DYNAMIC_DRAW)
+
+    def updateBuffer(self, byteOffset, bufferDataArray: np.ndarray):
+        """
+        Overwrite part of the buffer, starting at byteOffset
+        """
+        self.bind()
+        gl.glBufferSubData(gl.GL_UNIFORM_BUFFER, byteOffset, bufferDataArray.nbytes, bufferDataArray)
+
 
 class Texture:
     """
     Packed help functions to deal with texture mapping in OpenGL, can be used to store multiple textures
+
+    Texture units are assigned when a texture is bound, not when it is created. A texture keeps its unit as long as
+    no other texture needs it, so drawing with it again costs neither a bind nor a sampler uniform update. Once every
+    unit holds a texture, the least recently bound one is replaced. Unit 0 never gets a texture, samplers of draws
+    without texture point there.
     """
     textureName = 0
-    textureUnitID = 0
+    textureUnitID = 0  # unit this texture was last bound to, 0 if it never was
+    pendingImage = None  # image prepared by loadImage and not uploaded yet
 
-    def __init__(self):
-        global NextTextureID
+    key = None  # TextureCache key, None for a texture owned by a single Component
+    refCount = 0
+
+    # units handed out to textures, 1 to unitCount - 1. 16 is the minimum number of fragment shader units GL requires
+    unitCount = 16
 
-        # assign a texture image unit for this sampler
-        self.textureUnitID = NextTextureID
-        NextTextureID = NextTextureID % 16 + 1
+    # shadow of the texture bindings in the GL context, shared by all textures: active unit and unit -> texture name.
+    # Units are ordered from least to most recently bound
+    activeUnit = None
+    boundTextures = OrderedDict()
 
     def setTextureImage(self, image):
-        self.textureName = gl.glGenTextures(1)
+        self.loadImage(image)
+        self.upload()
+
+    def loadImage(self, image):
+        """
+        Prepare image for upload without any GL call, so it can run on any thread. The image is uploaded by the next
+        upload, or by the first bind
+
+        :param image: pixels in shape (height, width, channels), first row at the top
+        :type image: numpy.ndarray
+        """
         # flip image upside down.
         # trim to RGB channels, even if a channel provided
         image = image[::-1, :, 0:3]
-        image = image.astype(np.dtype("uint8"))
+        self.pendingImage = np.ascontiguousarray(image, dtype=np.dtype("uint8"))
 
+    def upload(self):
+        """
+        Create the GL texture from the image given to loadImage. Must run on the thread owning the GL context
+        """
+        if self.pendingImage is None:
+            return
+        image = self.pendingImage
+        self.pendingImage = None
+        self.textureName = gl.glGenTextures(1)
         height, width, channel = image.shape
         imageData = image.flatten("C")
 
-        gl.glBindTexture(gl.GL_TEXTURE_2D, self.textureName)
+        # bind through the unit allocator, so the shadow bindings stay valid
+        self.bindResident()
         gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_RGB, width, height, 0, gl.GL_RGB, gl.GL_UNSIGNED_BYTE, imageData)
         gl.glGenerateMipmap(gl.GL_TEXTURE_2D)
         self.setTextureParameters()
 
+    def delete(self):
+        """
+        Free the GL texture, if there is one
+        """
+        self.pendingImage = None
+        if self.textureName:
+            gl.glDeleteTextures([self.textureName])
+            # GL unbinds deleted textures from every unit
+            for unit, textureName in list(Texture.boundTextures.items()):
+                if textureName == self.textureName:
+                    Texture.boundTextures[unit] = 0
+            self.textureName = 0
+
     def setTextureParameters(self):
         # for 2D texture, need wrap along s and t
         gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_S, gl.GL_REPEAT)
@@ -183,13 +285,67 @@ class Texture:
         gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_LINEAR)
         gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_LINEAR)
 
-    def bind(self, glslVariableLoc):
-        gl.glActiveTexture(gl.GL_TEXTURE0 + self.textureUnitID)
-        gl.glBindTexture(gl.GL_TEXTURE_2D, self.textureName)
-        gl.glUniform1i(glslVariableLoc, self.textureUnitID)
+    @staticmethod
+    def bindUnit(unit, textureName):
+        """
+        Bind textureName to texture unit, skipping GL calls which would not change the bindings
+        """
+        if Texture.boundTextures.get(unit) == textureName:
+            return
+        if Texture.activeUnit != unit:
+            gl.glActiveTexture(gl.GL_TEXTURE0 + unit)
+            Texture.activeUnit = unit
+        gl.glBindTexture(gl.GL_TEXTURE_2D, textureName)
+        Texture.boundTextures[unit] = textureName
+
+    @staticmethod
+    def invalidateState():
+        """
+        Forget the shadow bindings. Required after binding textures directly or switching to a new GL context
+        """
+        Texture.activeUnit = None
+        Texture.boundTextures.clear()
+
+    @staticmethod
+    def allocateUnit():
+        """
+        :return: a unit without texture, or the least recently bound unit if there is none
+        :rtype: int
+        """
+        for unit in range(1, Texture.unitCount):
+            if not Texture.boundTextures.get(unit):
+                return unit
+        return next(unit for unit in Texture.boundTextures if unit != 0)
+
+    def bindResident(self):
+        """
+        Make sure this texture is bound to a unit, keeping the unit it is already in
 
-    def unbind(self, glslVariableLoc):
-        gl.glActiveTexture(gl.GL_TEXTURE0)
-        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
-        gl.glUniform1i(glslVariableLoc, 0)
+        :return: unit this texture is bound to
+        :rtype: int
+        """
+        if self.textureUnitID == 0 or Texture.boundTextures.get(self.textureUnitID) != self.textureName:
+            self.textureUnitID = self.allocateUnit()
+            self.bindUnit(self.textureUnitID, self.textureName)
+        Texture.boundTextures.move_to_end(self.textureUnitID)
+        return self.textureUnitID
 
+    def bind(self, glslVariableLoc=None):
+        """
+        :param glslVariableLoc: sampler uniform location to point at this texture's unit. If not given, the caller
+                                sets the sampler itself to the returned unit, e.g. through GLProgram.setInt
+        :return: unit this texture is bound to
+        :rtype: int
+        """
+        self.upload()
+        unit = self.bindResident()
+        if glslVariableLoc is not None:
+            gl.glUniform1i(glslVariableLoc, unit)
+        return unit
+
+    def unbind(self, glslVariableLoc=None):
+        """
+        Point a sampler at unit 0, which never holds a texture. Textures stay resident in their units
+        """
+        if glslVariableLoc is not None:
+            gl.glUniform1i(glslVariableLoc, 0)
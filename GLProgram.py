@@ -1,4 +1,5 @@
 from Light import Light
+from LightBuffer import LightBuffer
 
 try:
     import OpenGL
@@ -41,12 +42,43 @@ def perspectiveMatrix(angleOfView, near, far):
     result[3, 3] = 0
 
 
-class GLProgram:
+class ShaderVariant:
+    """
+    One linked program of a GLProgram, compiled for a single rendering routing combination.
+    Uniform locations and the values last uploaded to them are tracked per variant.
+    """
     program = None
+    renderingFlag = 0
+    nameLocations = None  # dict<str, int>, program variable name -> uniform location
+    locations = None  # dict<int, int>, uniform handle -> uniform location
+    uniformValues = None  # dict<int, object>, uniform handle -> last uploaded value
+
+    def __init__(self, program, renderingFlag):
+        self.program = program
+        self.renderingFlag = renderingFlag
+        self.nameLocations = {}
+        self.locations = {}
+        self.uniformValues = {}
+
+
+class GLProgram:
+    program = None  # program of the current variant
 
     vertexShaderSource = None
     fragmentShaderSource = None
     attribs = None
+    lightBuffer = None  # LightBuffer, created on compile, shared by all variants
+
+    # shader variants, one per routing combination. They are compiled on first use
+    variants = None  # dict<int, ShaderVariant>, rendering flag -> variant
+    currentVariant = None
+    routingFlags = None  # dict<str, int>, routing string -> rendering flag
+
+    # uniforms are addressed by handles shared between variants. uniformData keeps the last value set through every
+    # handle, so a variant can catch up with values set while another one was current
+    uniformHandles = None  # dict<str, int>, program variable name -> handle
+    uniformNames = None  # list<str>, handle -> program variable name
+    uniformData = None  # dict<int, tuple>, handle -> (upload method name, value)
 
     vs = None  # vertex shader
     fs = None  # Fragment shader
@@ -54,10 +86,36 @@ class GLProgram:
     ready = False  # a control flag which reflect if this GLprogram is ready
     debug = 0
 
-    def __init__(self) -> None:
-        self.program = gl.glCreateProgram()
+    # GL state shadowing. currentProgram is the program bound by the last use, shared by all GLProgram in the context
+    currentProgram = None
+    callStats = {"useIssued": 0, "useElided": 0, "uniformIssued": 0, "uniformElided": 0}
+
+    # rendering flag bit, the macro enabling its code in the fragment shader, and routing names turning it on
+    routingTable = ((0x1, "ROUTING_LIGHTING", ("lighting", "illumination")),
+                    (0x1 << 1, "ROUTING_VERTEX", ("vertex",)),
+                    (0x1 << 2, "ROUTING_PURE", ("pure",)),
+                    (0x1 << 3, "ROUTING_NORMAL", ("normal",)),
+                    (0x1 << 4, "ROUTING_BUMP", ("bump",)),
+                    (0x1 << 5, "ROUTING_ARTIST", ("artist",)),
+                    (0x1 << 6, "ROUTING_CUSTOM", ("custom",)),
+                    (0x1 << 8, "ROUTING_TEXTURE", ("texture",)),
+                    (0x1 << 9, "INSTANCED", ()))
+    defaultRenderingFlag = 0x1
+    instancedFlag = 0x1 << 9
+
+    # attributes are bound to the same locations in every variant, so one VAO works with all of them
+    # per-instance matrices take one location per column
+    attribLocations = {"vertexPos": 0, "vertexNormal": 1, "vertexColor": 2, "vertexTexture": 3,
+                       "vertexT": 4, "vertexB": 5,
+                       "instanceModel": 6, "instanceNormal": 10, "instanceDiffuse": 13}
 
+    def __init__(self) -> None:
         self.ready = False
+        self.variants = {}
+        self.routingFlags = {}
+        self.uniformHandles = {}
+        self.uniformNames = []
+        self.uniformData = {}
 
         # define attribs name and corresponding method to set it
         self.attribs = {
@@ -73,16 +131,23 @@ class GLProgram:
             "vertexTexture": "aTexture",
             "vertexT": "vertexT",
             "vertexB": "vertexB",
+            "instanceModel": "instanceModel",
+            "instanceNormal": "instanceNormal",
+            "instanceDiffuse": "instanceDiffuse",
 
             "textureImage": "theTexture01",
 
             "projectionMat": "projection",
             "viewMat": "view",
             "modelMat": "model",
+            "normalMat": "normalMatrix",
 
             "viewPosition": "viewPosition",
             "material": "material",
             "light": "light",
+            "lightBlock": "LightBlock",
+            "lightBlockBinding": "0",
+            "lightCount": "lightCount",
 
             "maxLightsNum": "20",
             "maxMaterialNum": "20"
@@ -106,8 +171,13 @@ class GLProgram:
         self.fragmentShaderSource = self.genFragShaderSource()
 
     def __del__(self) -> None:
+        if GLProgram.currentProgram == self.program:
+            GLProgram.currentProgram = None
         try:
-            gl.glDeleteProgram(self.program)
+            if self.lightBuffer is not None:
+                self.lightBuffer.delete()
+            for variant in self.variants.values():
+                gl.glDeleteProgram(variant.program)
         except Exception as e:
             pass
 
@@ -141,17 +211,33 @@ class GLProgram:
         out int materialIndex;
         out vec3 vT;
         out vec3 vB;
+
+        #ifdef INSTANCED
+        in mat4 {self.attribs["instanceModel"]};
+        in mat3 {self.attribs["instanceNormal"]};
+        in vec4 {self.attribs["instanceDiffuse"]};
+        flat out vec4 vDiffuse;
+        #endif
         
         uniform mat4 {self.attribs["projectionMat"]};
         uniform mat4 {self.attribs["viewMat"]};
         uniform mat4 {self.attribs["modelMat"]};
+        uniform mat3 {self.attribs["normalMat"]};
         
         void main()
         {{
-            gl_Position = {self.attribs["projectionMat"]} * {self.attribs["viewMat"]} * {self.attribs["modelMat"]} * vec4({self.attribs["vertexPos"]}, 1.0);
-            vPos = vec3(model * vec4({self.attribs["vertexPos"]}, 1.0));
+            mat4 modelMatrix = {self.attribs["modelMat"]};
+            mat3 normalMatrix = {self.attribs["normalMat"]};
+            #ifdef INSTANCED
+            // instance transformations are relative to the component
+            modelMatrix = modelMatrix * {self.attribs["instanceModel"]};
+            normalMatrix = normalMatrix * {self.attribs["instanceNormal"]};
+            vDiffuse = {self.attribs["instanceDiffuse"]};
+            #endif
+            gl_Position = {self.attribs["projectionMat"]} * {self.attribs["viewMat"]} * modelMatrix * vec4({self.attribs["vertexPos"]}, 1.0);
+            vPos = vec3(modelMatrix * vec4({self.attribs["vertexPos"]}, 1.0));
             vColor = {self.attribs["vertexColor"]};
-            vNormal = normalize(transpose(inverse({self.attribs["modelMat"]})) * vec4({self.attribs["vertexNormal"]}, 0.0) ).xyz;
+            vNormal = normalize(normalMatrix * {self.attribs["vertexNormal"]});
             vTexture = {self.attribs["vertexTexture"]};
             vT = {self.attribs["vertexT"]};
             vB = {self.attribs["vertexB"]};
@@ -190,13 +276,18 @@ class GLProgram:
         in vec2 vTexture;
         in vec3 vT;
         in vec3 vB;
+        #ifdef INSTANCED
+        flat in vec4 vDiffuse;
+        #endif
         
-        uniform int renderingFlag;
         uniform sampler2D {self.attribs["textureImage"]};
         
         uniform vec3 {self.attribs["viewPosition"]};
         uniform Material {self.attribs["material"]};
-        uniform Light {self.attribs["light"]}[MAX_LIGHT_NUM];
+        layout(std140) uniform {self.attribs["lightBlock"]}{{
+            Light {self.attribs["light"]}[MAX_LIGHT_NUM];
+        }};
+        uniform int {self.attribs["lightCount"]};
 
         uniform bool {self.attribs["ambientOn"]};
         uniform bool {self.attribs["diffuseOn"]};
@@ -222,6 +313,7 @@ class GLProgram:
             //   1. Perform the same steps as Texture Mapping above, except that instead of using the image for vertex 
             //   color, the image is used to modify the normals.
             //   2. Use the input normal map (“./assets/normalmap.jpg”) on both the sphere and the torus.
+            #ifdef ROUTING_LIGHTING
             vec3 texture_normal = texture({self.attribs["textureImage"]}, vTexture).xyz; 
             texture_normal = normalize(texture_normal);
             vec3 T = normalize(vT);
@@ -229,9 +321,11 @@ class GLProgram:
             vec3 N = normalize(vNormal);
             mat3 TBN = mat3(T, B, N);
             vec3 sphere_normal = TBN * texture_normal;
+            #endif
 
             // Reserved for illumination rendering, routing name is "lighting" or "illumination"
-            if ((renderingFlag >> 0 & 0x1) == 1){{
+            #ifdef ROUTING_LIGHTING
+            {{
                 vec4 result = vec4(vColor, 1.0);
 
                 ////////// TODO 3: Illuminate your meshes
@@ -246,6 +340,9 @@ class GLProgram:
                 vec4 I_spe = vec4(0, 0, 0, 0);
                 vec4 k_a = {self.attribs["material"]}.ambient;
                 vec4 k_d = {self.attribs["material"]}.diffuse;
+                #ifdef INSTANCED
+                k_d = vDiffuse;
+                #endif
                 vec4 k_s = {self.attribs["material"]}.specular;
                 float n_s = {self.attribs["material"]}.highlight;
 
@@ -253,7 +350,7 @@ class GLProgram:
                 vec4 I_a = vec4(vColor, 1.0);
                 I_amb = k_a * I_a;
 
-                for(int i = 0; i < MAX_LIGHT_NUM; i++){{
+                for(int i = 0; i < {self.attribs["lightCount"]}; i++){{
                     Light li = {self.attribs["light"]}[i];
                     vec4 I_li = li.color;
 
@@ -320,21 +417,31 @@ class GLProgram:
                 results[ri] = result;
                 ri+=1;
             }}
+            #endif
             
             // Reserved for rendering with vertex color, routing name is "vertex"
-            if ((renderingFlag >> 1 & 0x1) == 1){{
+            #ifdef ROUTING_VERTEX
+            {{
                 results[ri] = vec4(vColor, 1.0);
+                #ifdef INSTANCED
+                // instance color tints the vertex color, a white mesh takes the instance color as it is
+                results[ri] = vec4(vColor * vDiffuse.rgb, 1.0);
+                #endif
                 ri+=1;
             }}
+            #endif
             
             // Reserved for rendering with fixed color, routing name is "pure"
-            if ((renderingFlag >> 2 & 0x1) == 1){{
+            #ifdef ROUTING_PURE
+            {{
                 results[ri] = vec4(0.5, 0.5, 0.5, 1.0);
                 ri+=1;
             }}
+            #endif
             
             // Reserved for normal rendering, routing name is "normal"
-            if ((renderingFlag >> 3 & 0x1) == 1){{
+            #ifdef ROUTING_NORMAL
+            {{
             
                 ////////// TODO 2: Set Normal Rendering
                 // Requirements:
@@ -348,26 +455,33 @@ class GLProgram:
                 results[ri] = vec4(normalized_vNormal.x, normalized_vNormal.y, normalized_vNormal.z, 1.0);
                 ri+=1;
             }}
+            #endif
             
             // Reserved for artist rendering, routing name is "artist"
-            if ((renderingFlag >> 5 & 0x1) == 1){{
+            #ifdef ROUTING_ARTIST
+            {{
                 // unused 
                 results[ri] = vec4(0.5, 0.5, 0.5, 1.0);
                 ri+=1;
             }}
+            #endif
             
             // Reserved for some customized rendering, routing name is "custom"
-            if ((renderingFlag >> 6 & 0x1) == 1){{
+            #ifdef ROUTING_CUSTOM
+            {{
                 results[ri] = vec4(0.5, 0.5, 0.5, 1.0);
                 ri+=1;
             }}
+            #endif
             
             // Reserved for texture mapping, get point color from texture image and texture coordinates
             // Routing name is "texture"
-            if ((renderingFlag >> 8 & 0x1) == 1){{
+            #ifdef ROUTING_TEXTURE
+            {{
                 results[ri] = texture({self.attribs["textureImage"]}, vTexture);
                 ri+=1;
             }}
+            #endif
             
             // Mix all result in results array
             vec4 outputResult=vec4(0.0);
@@ -390,56 +504,173 @@ class GLProgram:
         self.fragmentShaderSource = fss
 
     def getAttribLocation(self, name):
-        programName = self.getAttribName(name)
-        attribLoc = gl.glGetAttribLocation(self.program, programName)
-        if attribLoc == -1 and self.debug > 1:
-            print(f"Warning: Attrib {name} cannot found. Might have been optimized off")
-        return attribLoc
+        """
+        Attributes have fixed locations, bound before linking every variant
+        """
+        if name not in self.attribLocations and self.debug > 1:
+            print(f"Warning: Attrib {name} cannot found")
+        return self.attribLocations.get(name, -1)
 
-    def getUniformLocation(self, name, lookThroughAttribs=True):
+    def getUniformHandle(self, name, lookThroughAttribs=True):
+        """
+        Resolve a uniform name once. The handle is valid in every variant, and all set methods accept it in place of
+        the name. A handle passed as name is returned unchanged.
+
+        :rtype: int
+        """
+        if isinstance(name, (int, np.integer)):
+            return name
         if lookThroughAttribs:
             variableName = self.getAttribName(name)
         else:
             variableName = name
-        uniformLoc = gl.glGetUniformLocation(self.program, variableName)
-        if uniformLoc == -1 and self.debug > 1:
-            print(f"Warning: Uniform {name} cannot found. Might have been optimized off")
-        return uniformLoc
+        handle = self.uniformHandles.get(variableName)
+        if handle is None:
+            handle = len(self.uniformNames)
+            self.uniformHandles[variableName] = handle
+            self.uniformNames.append(variableName)
+        return handle
+
+    def getUniformLocation(self, name, lookThroughAttribs=True):
+        """
+        :param name: uniform name or handle
+        :return: location of the uniform in the current variant, -1 if it doesn't exist there
+        """
+        return self.variantLocation(self.currentVariant, self.getUniformHandle(name, lookThroughAttribs))
+
+    def variantLocation(self, variant, handle):
+        location = variant.locations.get(handle)
+        if location is None:
+            variableName = self.uniformNames[handle]
+            location = variant.nameLocations.get(variableName)
+            if location is None:
+                # not an active uniform, or a name spelled differently than introspection reports it. Ask once
+                location = gl.glGetUniformLocation(variant.program, variableName)
+                if location == -1 and self.debug > 1:
+                    print(f"Warning: Uniform {variableName} cannot found. Might have been optimized off")
+            variant.locations[handle] = location
+        return location
+
+    @staticmethod
+    def introspectUniforms(program):
+        """
+        Build the uniform location table from all active uniforms of a linked program.
+        Each element of an array of basic types is added by its own name as well.
+
+        :return: dict<str, int>, program variable name -> uniform location
+        """
+        uniformLocations = {}
+        uniformNum = gl.glGetProgramiv(program, gl.GL_ACTIVE_UNIFORMS)
+        for i in range(uniformNum):
+            variableName, size, _ = gl.glGetActiveUniform(program, i)
+            variableName = variableName.decode() if isinstance(variableName, bytes) else variableName
+            location = gl.glGetUniformLocation(program, variableName)
+            if location == -1:
+                # members of uniform blocks live in buffers, they have no location
+                continue
+            uniformLocations[variableName] = location
+            if variableName.endswith("[0]"):
+                arrayName = variableName[:-3]
+                uniformLocations[arrayName] = location
+                for j in range(1, size):
+                    uniformLocations[f"{arrayName}[{j}]"] = gl.glGetUniformLocation(program, f"{arrayName}[{j}]")
+        return uniformLocations
 
     def getAttribName(self, attribIndexName):
         return self.attribs[attribIndexName]
 
     def compile(self, vs_src=None, fs_src=None) -> None:
+        """
+        Set shader sources, and build the default variant. Other variants are built when their routing is first used
+        """
         if vs_src:
             self.set_vss(vs_src)
-        else:
-            vs_src = self.vertexShaderSource
-
         if fs_src:
             self.set_fss(fs_src)
-        else:
-            fs_src = self.fragmentShaderSource
 
-        if not (vs_src and fs_src):
+        if not (self.vertexShaderSource and self.fragmentShaderSource):
             raise Exception("shader source code missing")
 
-        vs = self.load_shader(vs_src, gl.GL_VERTEX_SHADER)
-        if not vs:
-            return
-        fs = self.load_shader(fs_src, gl.GL_FRAGMENT_SHADER)
-        if not fs:
-            return
-        gl.glAttachShader(self.program, vs)
-        gl.glAttachShader(self.program, fs)
-        gl.glLinkProgram(self.program)
-        error = gl.glGetProgramiv(self.program, gl.GL_LINK_STATUS)
+        for variant in self.variants.values():
+            gl.glDeleteProgram(variant.program)
+        self.variants = {}
+        if self.lightBuffer is None:
+            self.lightBuffer = LightBuffer(int(self.attribs["maxLightsNum"]), int(self.attribs["lightBlockBinding"]))
+        self.ready = True
+        self.selectVariant(self.defaultRenderingFlag)
+
+    def variantSource(self, src, renderingFlag):
+        """
+        Insert a #define for every routing in renderingFlag right after the #version line
+        """
+        defines = "".join(f"#define {macro}\n" for flag, macro, _ in self.routingTable if renderingFlag & flag)
+        versionEnd = src.index("\n", src.index("#version")) + 1
+        return src[:versionEnd] + defines + src[versionEnd:]
+
+    def buildVariant(self, renderingFlag):
+        """
+        Compile and link the program for one routing combination
+
+        :rtype: ShaderVariant
+        """
+        vs = self.load_shader(self.variantSource(self.vertexShaderSource, renderingFlag), gl.GL_VERTEX_SHADER)
+        fs = self.load_shader(self.variantSource(self.fragmentShaderSource, renderingFlag), gl.GL_FRAGMENT_SHADER)
+        program = gl.glCreateProgram()
+        gl.glAttachShader(program, vs)
+        gl.glAttachShader(program, fs)
+        for name, location in self.attribLocations.items():
+            gl.glBindAttribLocation(program, location, self.getAttribName(name))
+        gl.glLinkProgram(program)
+        # shaders are owned by the program from now on
+        gl.glDeleteShader(vs)
+        gl.glDeleteShader(fs)
+        error = gl.glGetProgramiv(program, gl.GL_LINK_STATUS)
         if error != gl.GL_TRUE:
-            info = gl.glGetShaderInfoLog(self.program)
+            info = gl.glGetProgramInfoLog(program)
+            gl.glDeleteProgram(program)
             raise Exception(info)
 
-        self.ready = True
+        variant = ShaderVariant(program, renderingFlag)
+        variant.nameLocations = self.introspectUniforms(program)
+        lightBlockIndex = gl.glGetUniformBlockIndex(program, self.attribs["lightBlock"])
+        if lightBlockIndex != gl.GL_INVALID_INDEX:
+            gl.glUniformBlockBinding(program, lightBlockIndex, int(self.attribs["lightBlockBinding"]))
+        if self.debug > 1:
+            print(f"Compiled shader variant {renderingFlag:#x}")
+        return variant
+
+    def selectVariant(self, renderingFlag):
+        """
+        Make the variant for renderingFlag current, building it on first use. The new current variant is bound,
+        and every uniform value set while it was not current is uploaded to it
+        """
+        variant = self.variants.get(renderingFlag)
+        if variant is None:
+            variant = self.buildVariant(renderingFlag)
+            self.variants[renderingFlag] = variant
+        if variant is self.currentVariant:
+            return
+        self.currentVariant = variant
+        self.program = variant.program
+        for handle, (method, value) in self.uniformData.items():
+            self.uploadUniform(handle, method, value)
 
-    def setFragmentShaderRouting(self, routing="lighting"):
+    def routingFlag(self, routing):
+        """
+        :return: rendering flag of a routing string, computed once per string
+        """
+        renderingFlag = self.routingFlags.get(routing)
+        if renderingFlag is None:
+            renderingFlag = 0
+            if isinstance(routing, str):
+                lowerRouting = routing.lower()
+                for flag, _, names in self.routingTable:
+                    if any(name in lowerRouting for name in names):
+                        renderingFlag = renderingFlag | flag
+            self.routingFlags[routing] = renderingFlag
+        return renderingFlag
+
+    def setFragmentShaderRouting(self, routing="lighting", instanced=False):
         """
         There will be different rendering routing,
         "lighting"/"illumination": DEFAULT routing. Rendering the scene with lights
@@ -450,29 +681,15 @@ class GLProgram:
         "artist": artist rendering
         "custom": some customized rendering
         "texture": this must use previous routing, if set to true, then mix color with texture
-        """
-        renderingFlag = 0
-        if isinstance(routing, str):
-            routing = routing.lower()
-            if ("lighting" in routing) or ("illumination" in routing):
-                renderingFlag = renderingFlag | 0x1
-            if "vertex" in routing:
-                renderingFlag = renderingFlag | (0x1 << 1)
-            if "pure" in routing:
-                renderingFlag = renderingFlag | (0x1 << 2)
-            if "normal" in routing:
-                renderingFlag = renderingFlag | (0x1 << 3)
-            if "bump" in routing:
-                renderingFlag = renderingFlag | (0x1 << 4)
-            if "artist" in routing:
-                renderingFlag = renderingFlag | (0x1 << 5)
-            if "custom" in routing:
-                renderingFlag = renderingFlag | (0x1 << 6)
-            if "texture" in routing:
-                renderingFlag = renderingFlag | (0x1 << 8)
 
+        Every combination of routings is a separate shader variant, switching routing switches the program in use.
+        If instanced is set, the variant reading per-instance transformation and diffuse color is used.
+        """
+        renderingFlag = self.routingFlag(routing)
+        if instanced:
+            renderingFlag = renderingFlag | self.instancedFlag
+        self.selectVariant(renderingFlag)
         self.use()
-        self.setInt("renderingFlag", renderingFlag, lookThroughAttribs=False)
 
     def use(self):
         """
@@ -480,78 +697,126 @@ class GLProgram:
         """
         if not self.ready:
             raise Exception("GLProgram must compile before use it")
+        if GLProgram.currentProgram == self.program:
+            GLProgram.callStats["useElided"] += 1
+            return
         gl.glUseProgram(self.program)
+        GLProgram.currentProgram = self.program
+        GLProgram.callStats["useIssued"] += 1
+        # the binding point is context state, other programs may have attached their own light buffer to it
+        self.lightBuffer.bind()
 
-    def setLight(self, lightIndex: int, light: Light):
-        if not isinstance(light, Light):
-            raise TypeError("light type must be Light")
+    def uploadUniform(self, handle, method, value):
+        """
+        Upload value to the current variant, unless the uniform already holds it there
+
+        :param method: name of the gl.glUniform* function
+        :param value: float32 ndarray for vectors and matrices, int or float for scalars
+        """
+        variant = self.currentVariant
+        location = self.variantLocation(variant, handle)
+        key = value.tobytes() if isinstance(value, np.ndarray) else value
+        if location == -1 or variant.uniformValues.get(handle) == key:
+            GLProgram.callStats["uniformElided"] += 1
+            return
+        variant.uniformValues[handle] = key
+        GLProgram.callStats["uniformIssued"] += 1
+        self.use()
+        if method.startswith("glUniformMatrix"):
+            getattr(gl, method)(location, 1, gl.GL_FALSE, value)
+        elif method.endswith("fv"):
+            getattr(gl, method)(location, 1, value)
+        else:
+            getattr(gl, method)(location, value)
 
-        self.setVec3(f"""{self.attribs["light"]}[{lightIndex}].position""", light.position, False)
-        self.setVec4(f"""{self.attribs["light"]}[{lightIndex}].color""", light.color, False)
+    def setUniform(self, name, method, value, lookThroughAttribs=True):
+        handle = self.getUniformHandle(name, lookThroughAttribs)
+        self.uniformData[handle] = (method, value)
+        self.uploadUniform(handle, method, value)
 
-        self.setBool(f"""{self.attribs["light"]}[{lightIndex}].infiniteOn""", light.infiniteOn, False)
-        self.setVec3(f"""{self.attribs["light"]}[{lightIndex}].infiniteDirection""", light.infiniteDirection, False)
+    @classmethod
+    def invalidateState(cls):
+        """
+        Forget the bound program. Required after switching to a new GL context
+        """
+        cls.currentProgram = None
 
-        self.setBool(f"""{self.attribs["light"]}[{lightIndex}].spotOn""", light.spotOn, False)
-        self.setVec3(f"""{self.attribs["light"]}[{lightIndex}].spotDirection""", light.spotDirection, False)
-        self.setVec3(f"""{self.attribs["light"]}[{lightIndex}].spotRadialFactor""", light.spotRadialFactor, False)
-        self.setFloat(f"""{self.attribs["light"]}[{lightIndex}].spotAngleLimit""", light.spotAngleLimit, False)
+    @classmethod
+    def stats(cls):
+        """
+        :return: number of issued and elided glUseProgram and glUniform calls
+        :rtype: dict
+        """
+        return dict(cls.callStats)
+
+    @classmethod
+    def resetStats(cls):
+        for key in cls.callStats:
+            cls.callStats[key] = 0
+
+    def setLight(self, lightIndex: int, light: Light):
+        """
+        Lights are stored in a uniform buffer, changes take effect after the next flushLights
+        """
+        self.lightBuffer.setLight(lightIndex, light)
+
+    def setLightEnabled(self, lightIndex: int, enabled: bool):
+        """
+        Turn a light on or off without forgetting it. Disabled lights cost nothing in the shader
+        """
+        self.lightBuffer.setEnabled(lightIndex, enabled)
 
     def clearAllLights(self):
-        maxLightsNum = int(self.attribs["maxLightsNum"])
-        light = Light()
-        for i in range(maxLightsNum):
-            self.setLight(i, light)
+        self.lightBuffer.clear()
+
+    def flushLights(self):
+        """
+        Upload lights changed since the last flush, and the number of active lights.
+        Call this once per frame before drawing
+        """
+        self.setInt("lightCount", self.lightBuffer.flush())
 
-    # some help methods to set uniform in program
+    # some help methods to set uniform in program. name can be a uniform name, or a handle from getUniformHandle.
+    # Uploads are skipped if the uniform already holds the same value
     def setMat4(self, name, mat, lookThroughAttribs=True):
-        self.use()
         if mat.shape != (4, 4):
             raise Exception("Projection Matrix must have 4x4 shape")
-        gl.glUniformMatrix4fv(self.getUniformLocation(name, lookThroughAttribs), 1, gl.GL_FALSE, mat.flatten("C"))
+        self.setUniform(name, "glUniformMatrix4fv", np.asarray(mat, dtype=np.float32).flatten("C"), lookThroughAttribs)
 
     def setMat3(self, name, mat, lookThroughAttribs=True):
-        self.use()
         if mat.shape != (3, 3):
             raise Exception("Projection Matrix must have 3x3 shape")
-        gl.glUniformMatrix3fv(self.getUniformLocation(name, lookThroughAttribs), 1, gl.GL_FALSE, mat.flatten("C"))
+        self.setUniform(name, "glUniformMatrix3fv", np.asarray(mat, dtype=np.float32).flatten("C"), lookThroughAttribs)
 
     def setMat2(self, name, mat, lookThroughAttribs=True):
-        self.use()
         if mat.shape != (2, 2):
             raise Exception("Projection Matrix must have 2x2 shape")
-        gl.glUniformMatrix2fv(self.getUniformLocation(name, lookThroughAttribs), 1, gl.GL_FALSE, mat.flatten("C"))
+        self.setUniform(name, "glUniformMatrix2fv", np.asarray(mat, dtype=np.float32).flatten("C"), lookThroughAttribs)
 
     def setVec4(self, name, vec, lookThroughAttribs=True):
-        self.use()
         if vec.size != 4:
             raise Exception("Vector must have size 4")
-        gl.glUniform4fv(self.getUniformLocation(name, lookThroughAttribs), 1, vec)
+        self.setUniform(name, "glUniform4fv", np.asarray(vec, dtype=np.float32), lookThroughAttribs)
 
     def setVec3(self, name, vec, lookThroughAttribs=True):
-        self.use()
         if vec.size != 3:
             raise Exception("Vector must have size 3")
-        gl.glUniform3fv(self.getUniformLocation(name, lookThroughAttribs), 1, vec)
+        self.setUniform(name, "glUniform3fv", np.asarray(vec, dtype=np.float32), lookThroughAttribs)
 
     def setVec2(self, name, vec, lookThroughAttribs=True):
-        self.use()
         if vec.size != 2:
             raise Exception("Vector must have size 2")
-        gl.glUniform2fv(self.getUniformLocation(name, lookThroughAttribs), 1, vec)
+        self.setUniform(name, "glUniform2fv", np.asarray(vec, dtype=np.float32), lookThroughAttribs)
 
     def setBool(self, name, value, lookThroughAttribs=True):
-        self.use()
         if value not in (0, 1):
             raise Exception("bool only accept True/False/0/1")
-        gl.glUniform1i(self.getUniformLocation(name, lookThroughAttribs), int(value))
+        self.setUniform(name, "glUniform1i", int(value), lookThroughAttribs)
 
     def setInt(self, name, value, lookThroughAttribs=True):
-        self.use()
         if value != int(value):
             raise Exception("set int only accept  integer")
-        gl.glUniform1i(self.getUniformLocation(name, lookThroughAttribs), int(value))
+        self.setUniform(name, "glUniform1i", int(value), lookThroughAttribs)
 
     def setFloat(self, name, value, lookThroughAttribs=True):
-        self.use()
-        gl.glUniform1f(self.getUniformLocation(name, lookThroughAttribs), float(value))
+        self.setUniform(name, "glUniform1f", float(value), lookThroughAttribs)
@@ -152,3 +152,55 @@ class GLUtility:
         result[3, 3] = 1
 
         return result.transpose() if columnMajor else result
+
+    @staticmethod
+    def normalMatrices(transformationMats):
+        """
+        Normal matrices of a batch of column-major transformations, ready to upload as mat3 uniforms.
+        Like the transformations, they are stored column-major: the transpose of the inverse of the upper-left 3x3,
+        which the shader reads as the upper-left 3x3 of transpose(inverse(model)).
+        Degenerate transformations (zero scaling) get the identity.
+
+        :param transformationMats: column-major transformations in shape (n, 4, 4)
+        :return: normal matrices in shape (n, 3, 3)
+        """
+        linearParts = np.array(transformationMats, dtype=np.float64)[:, 0:3, 0:3]
+        singular = np.abs(np.linalg.det(linearParts)) < 1e-12
+        linearParts[singular] = np.identity(3)
+        return np.linalg.inv(linearParts).transpose(0, 2, 1)
+
+    @staticmethod
+    def enclosingSphere(centers, radii):
+        """
+        A sphere containing all given spheres, centered at the middle of their bounding box. Not the smallest one, but
+        cheap to compute
+
+        :param centers: sphere centers in shape (n, 3)
+        :param radii: sphere radii in shape (n, )
+        :return: center as a (3, ) ndarray, and radius
+        """
+        centers = np.asarray(centers, dtype=np.float64).reshape(-1, 3)
+        radii = np.asarray(radii, dtype=np.float64)
+        center = (np.min(centers - radii[:, None], axis=0) + np.max(centers + radii[:, None], axis=0)) / 2
+        if not np.all(np.isfinite(center)):
+            return np.zeros(3), math.inf
+        return center, float(np.max(np.linalg.norm(centers - center, axis=1) + radii))
+
+    @staticmethod
+    def raySpheres(origin, direction, centers, radii):
+        """
+        Distances along a ray to a batch of spheres
+
+        :param direction: normalized ray direction
+        :param centers: sphere centers in shape (k, 3)
+        :param radii: sphere radii in shape (k, )
+        :return: distances along the ray where it enters every sphere, 0 if origin is inside, inf if it misses
+        """
+        offsets = origin - centers
+        b = offsets @ direction
+        with np.errstate(invalid="ignore"):
+            c = np.sum(offsets * offsets, axis=1) - radii * radii
+            discriminant = b * b - c
+            distances = np.where((b <= 0) & (discriminant >= 0), -b - np.sqrt(np.maximum(discriminant, 0)), np.inf)
+        distances[c <= 0] = 0
+        return distances
@@ -0,0 +1,253 @@
+"""
+Define a cache of GPU meshes here, so that identical Displayables generate and upload their geometry only once.
+
+:author: micou(Zezhou Sun)
+:version: 2021.1.1
+"""
+
+import itertools
+import threading
+
+import numpy as np
+
+from GLBuffer import VAO, VBO, EBO
+from GLUtility import GLUtility
+
+
+class GLMesh:
+    """
+    Vertex and index arrays together with the VAO, VBO and EBO they are uploaded to.
+    GL objects are created on the first initialize, so a GLMesh can be built before any GL context exists.
+    """
+    key = None
+    vertices = None  # array to store vertices information
+    indices = None  # stores triangle indices to vertices
+
+    vao = None
+    vbo = None
+    ebo = None
+
+    refCount = 0
+    initialized = False
+
+    # creation order of meshes, a sort key which doesn't change between runs like object ids do
+    serial = 0
+    serials = itertools.count()
+
+    center = None  # bounding sphere center
+    radius = None  # bounding sphere radius
+    rayTestData = None  # per triangle terms of the ray-triangle test, see intersectRay
+    # bounding spheres of runs of rayChunkSize consecutive triangles. Tessellated surfaces emit neighbouring triangles
+    # next to each other, so a ray only needs the exact test on the few runs whose spheres it hits
+    rayChunkCenters = None
+    rayChunkRadii = None
+    rayChunkSize = 64
+
+    # vertex attributes packed in every vertex, in column order. Attributes beyond the vertex size are skipped
+    attribLayout = (("vertexPos", 3),
+                    ("vertexNormal", 3),
+                    ("vertexColor", 3),
+                    ("vertexTexture", 2),
+                    ("vertexT", 3),
+                    ("vertexB", 3))
+
+    def __init__(self, key, vertices, indices):
+        self.key = key
+        self.vertices = vertices
+        self.indices = indices
+        self.refCount = 0
+        self.initialized = False
+        self.serial = next(GLMesh.serials)
+
+    def vertexSize(self):
+        return self.vertices.shape[-1]
+
+    def boundingSphere(self):
+        """
+        A sphere containing all vertices, centered at the middle of their bounding box. Computed once.
+
+        :return: center as a (3, ) ndarray, and radius
+        """
+        if self.radius is None:
+            positions = np.asarray(self.vertices[:, 0:3])
+            self.center = (positions.min(axis=0) + positions.max(axis=0)) / 2
+            self.radius = float(np.sqrt(np.max(np.sum((positions - self.center)**2, axis=1))))
+        return self.center, self.radius
+
+    def prepareRayTest(self):
+        """
+        Precompute the ray independent terms of the Moller-Trumbore test for every triangle, in shape (t, 16):
+        normal n = e1 x e2, e2, e1, e2 x v0, v0 x e1, and n . v0, where v0 is the first vertex and e1, e2 the edges
+        from it
+        """
+        positions = np.asarray(self.vertices[:, 0:3], dtype=np.float64)
+        triangles = positions[np.asarray(self.indices).reshape(-1, 3)]
+        v0 = triangles[:, 0]
+        e1 = triangles[:, 1] - v0
+        e2 = triangles[:, 2] - v0
+        normals = np.cross(e1, e2)
+        self.rayTestData = np.concatenate((normals, e2, e1, np.cross(e2, v0), np.cross(v0, e1),
+                                           np.sum(normals * v0, axis=1)[:, None]), axis=1).astype(np.float32)
+
+        # pad with copies of the last triangle, so every chunk is full
+        chunkNum = -(-len(triangles) // self.rayChunkSize)
+        padding = chunkNum * self.rayChunkSize - len(triangles)
+        triangles = np.concatenate((triangles, np.repeat(triangles[-1:], padding, axis=0)))
+        chunkPoints = triangles.reshape(chunkNum, self.rayChunkSize * 3, 3)
+        self.rayChunkCenters = (chunkPoints.min(axis=1) + chunkPoints.max(axis=1)) / 2
+        self.rayChunkRadii = np.sqrt(np.max(np.sum((chunkPoints - self.rayChunkCenters[:, None]) ** 2, axis=2),
+                                            axis=1))
+
+    def intersectRay(self, origin, direction):
+        """
+        Moller-Trumbore ray-triangle test against the triangles of all chunks the ray hits, at once. With the per
+        triangle terms from prepareRayTest, the determinant and the scaled barycentric coordinates and distance of all
+        triangles are linear in them, so the whole test is a single matrix product
+
+        :param origin: ray origin in this mesh's coordinates
+        :param direction: ray direction in this mesh's coordinates
+        :return: ray parameter of the nearest hit, so the hit is at origin + t * direction, and the hit triangle
+                 index. None if the ray misses
+        :rtype: tuple
+        """
+        if self.rayTestData is None:
+            self.prepareRayTest()
+        o = np.asarray(origin, dtype=np.float64)
+        d = np.asarray(direction, dtype=np.float64)
+        chunks = np.nonzero(np.isfinite(GLUtility.raySpheres(o, d / np.linalg.norm(d), self.rayChunkCenters,
+                                                             self.rayChunkRadii)))[0]
+        if len(chunks) == 0:
+            return None
+        rows = (chunks[:, None] * self.rayChunkSize + np.arange(self.rayChunkSize)).ravel()
+        rows = rows[rows < len(self.rayTestData)]
+        # columns give det, u * det, v * det and t * det for every triangle
+        factors = np.zeros((16, 4))
+        factors[0:3, 0] = -d
+        factors[3:6, 1] = np.cross(o, d)
+        factors[9:12, 1] = -d
+        factors[6:9, 2] = np.cross(d, o)
+        factors[12:15, 2] = -d
+        factors[0:3, 3] = o
+        factors[15, 3] = -1
+        det, u, v, t = (self.rayTestData[rows] @ factors.astype(np.float32)).transpose()
+        # flip signs so every comparison works with a positive determinant, either side of a triangle can be hit
+        sign = np.sign(det)
+        det = det * sign
+        u = u * sign
+        v = v * sign
+        t = t * sign
+        hit = (det > 0) & (u >= 0) & (v >= 0) & (u + v <= det) & (t >= 0)
+        candidates = np.nonzero(hit)[0]
+        if len(candidates) == 0:
+            return None
+        distances = t[candidates] / det[candidates]
+        nearest = np.argmin(distances)
+        return float(distances[nearest]), int(rows[candidates[nearest]])
+
+    def initialize(self, shaderProg):
+        """
+        Upload vertices and indices and set up attribute pointers. Only the first call does any work.
+        """
+        if self.initialized:
+            return
+        self.vao = VAO()
+        self.vbo = VBO()
+        self.ebo = EBO()
+
+        self.vao.bind()
+        self.vbo.setBuffer(self.vertices, self.vertexSize())
+        self.ebo.setBuffer(self.indices)
+        self.bindAttributes(shaderProg)
+        self.vao.unbind()
+        self.initialized = True
+
+    def bindAttributes(self, shaderProg):
+        """
+        Attach vertex attributes and indices of this mesh to the bound VAO. Lets other VAOs reuse the mesh buffers
+        """
+        stride = self.vertexSize()
+        self.ebo.bind()
+        offset = 0
+        for attribName, attribSize in self.attribLayout:
+            if offset + attribSize > stride:
+                break
+            self.vbo.setAttribPointer(shaderProg.getAttribLocation(attribName),
+                                      stride=stride, offset=offset, attribSize=attribSize)
+            offset += attribSize
+
+    def draw(self):
+        self.vao.bind()
+        self.ebo.draw()
+        self.vao.unbind()
+
+    def delete(self):
+        """
+        Free GL objects of this mesh
+        """
+        if self.initialized:
+            self.vao.delete()
+            self.vbo.delete()
+            self.ebo.delete()
+        self.initialized = False
+
+
+class GeometryCache:
+    """
+    Process-wide registry of GLMesh, keyed by primitive type and every parameter that affects its geometry
+    (size, tessellation, color). Meshes are reference counted, and freed once the last user releases them.
+
+    Scenes may be constructed on worker threads, so the registry is guarded by a lock. Generation runs outside of the
+    lock, and a key being generated is claimed first, so concurrent requests for it wait instead of generating it again.
+    """
+    meshes = {}  # dict<tuple, GLMesh>
+    generating = {}  # dict<tuple, threading.Event>, keys some thread is generating right now
+    lock = threading.Lock()
+
+    @classmethod
+    def acquire(cls, key, generate):
+        """
+        Get the mesh stored under key, and take a reference to it
+
+        :param key: hashable description of the mesh
+        :type key: tuple
+        :param generate: called without arguments on cache miss, returns vertices and indices of the mesh
+        :type generate: callable
+        :rtype: GLMesh
+        """
+        while True:
+            with cls.lock:
+                mesh = cls.meshes.get(key)
+                if mesh is not None:
+                    mesh.refCount += 1
+                    return mesh
+                done = cls.generating.get(key)
+                if done is None:
+                    done = cls.generating[key] = threading.Event()
+                    break
+            # another thread generates this mesh, look it up again once it is done
+            done.wait()
+
+        try:
+            mesh = GLMesh(key, *generate())
+            with cls.lock:
+                cls.meshes[key] = mesh
+                mesh.refCount += 1
+        finally:
+            with cls.lock:
+                del cls.generating[key]
+            done.set()
+        return mesh
+
+    @classmethod
+    def release(cls, mesh):
+        """
+        Drop one reference to mesh. The last reference deletes its GL objects, so this must run on the GL thread
+
+        :type mesh: GLMesh
+        """
+        with cls.lock:
+            mesh.refCount -= 1
+            if mesh.refCount <= 0:
+                mesh.delete()
+                if cls.meshes.get(mesh.key) is mesh:
+                    del cls.meshes[mesh.key]
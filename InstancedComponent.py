@@ -0,0 +1,227 @@
+"""
+Define a Component drawing many copies of its Displayable with a single instanced draw call.
+
+:author: micou(Zezhou Sun)
+:version: 2021.1.1
+"""
+
+import numpy as np
+
+from Component import Component
+from GLBuffer import VAO, VBO
+from GLUtility import GLUtility
+from Point import Point
+
+
+class InstancedComponent(Component):
+    """
+    Every instance has its own transformation relative to this component, and its own diffuse color.
+    Instance transformations, normal matrices and colors are packed into one instance VBO, whose attributes
+    advance once per instance, and all instances are drawn with one glDrawElementsInstanced.
+
+    The instance color replaces the material diffuse under "lighting" routing, and tints the vertex colors under
+    "vertex" routing. Like the material, it doesn't affect the fixed color, normal and texture routings.
+
+    The whole set of instances shares this component's material, routing, texture, and level of detail.
+    """
+    instanceMats = None  # ndarray (n, 4, 4), column-major transformations relative to this component
+    instanceColors = None  # ndarray (n, 4), diffuse color of every instance
+    instanced = True
+    instancesDirty = True  # instance data changed since the last upload
+
+    vao = None
+    instanceVbo = None
+    instanceMesh = None  # GLMesh the VAO was built for
+
+    # packed instance data: model matrix, normal matrix, diffuse color
+    instanceAttribSize = 16 + 9 + 4
+
+    def __init__(self, position, display_obj=None):
+        super().__init__(position, display_obj)
+        self.instanceMats = np.zeros((0, 4, 4))
+        self.instanceColors = np.zeros((0, 4))
+        self.instancesDirty = True
+
+    def addInstance(self, position, color=None, scale=1.0):
+        """
+        :param position: instance translation relative to this component
+        :type position: Point
+        :param color: diffuse color, defaults to this component's material diffuse
+        :type color: numpy.ndarray
+        :return: index of the new instance
+        :rtype: int
+        """
+        if not isinstance(position, Point):
+            raise TypeError("Incorrect Position, it should be Point type")
+        transformationMat = GLUtility.scale(scale, scale, scale) @ GLUtility.translate(*position.getCoords())
+        return self.addInstances(transformationMat[None], None if color is None else np.asarray(color)[None])
+
+    def addInstances(self, transformationMats, colors=None):
+        """
+        Add many instances at once
+
+        :param transformationMats: column-major transformations in shape (n, 4, 4)
+        :param colors: diffuse colors in shape (n, 4), defaults to this component's material diffuse
+        :return: index of the first new instance
+        :rtype: int
+        """
+        transformationMats = np.asarray(transformationMats, dtype=np.float64).reshape(-1, 4, 4)
+        if colors is None:
+            colors = np.tile(self.material.diffuse, (len(transformationMats), 1))
+        colors = np.asarray(colors, dtype=np.float64).reshape(-1, 4)
+        if len(colors) != len(transformationMats):
+            raise TypeError("Every instance needs exactly one color")
+        first = len(self.instanceMats)
+        self.instanceMats = np.concatenate((self.instanceMats, transformationMats))
+        self.instanceColors = np.concatenate((self.instanceColors, colors))
+        self.instancesChanged()
+        return first
+
+    def setInstanceTransformation(self, index, transformationMat):
+        """
+        :param index: instance index, or indices/mask of several instances
+        :param transformationMat: column-major transformation relative to this component
+        """
+        self.instanceMats[index] = transformationMat
+        self.instancesChanged()
+
+    def setInstancePosition(self, index, position):
+        """
+        Move instances, keeping their rotation and scaling
+
+        :param position: translation relative to this component, in shape (3, ) or (n, 3)
+        """
+        self.instanceMats[index, 3, 0:3] = position.getCoords() if isinstance(position, Point) else position
+        self.instancesChanged()
+
+    def setInstanceColor(self, index, color):
+        self.instanceColors[index] = color
+        self.instancesChanged()
+
+    def clearInstances(self):
+        self.instanceMats = np.zeros((0, 4, 4))
+        self.instanceColors = np.zeros((0, 4))
+        self.instancesChanged()
+
+    def instancesChanged(self):
+        """
+        Flag the instance VBO for upload, and the bounding spheres for the next update
+        """
+        self.instancesDirty = True
+        self.markDirty()
+
+    def instanceNum(self):
+        return len(self.instanceMats)
+
+    def packInstances(self):
+        """
+        :return: instance VBO content in shape (n, instanceAttribSize)
+        """
+        n = self.instanceNum()
+        data = np.empty((n, self.instanceAttribSize), dtype=np.float32)
+        data[:, 0:16] = self.instanceMats.reshape(n, 16)
+        data[:, 16:25] = GLUtility.normalMatrices(self.instanceMats).reshape(n, 9)
+        data[:, 25:29] = self.instanceColors
+        return data
+
+    def initialize(self):
+        super().initialize()
+        if self.displayObj is not None:
+            self.buildVao(self.displayObj.mesh)
+
+    def buildVao(self, mesh):
+        """
+        VAO combining the shared mesh buffers with this component's instance VBO
+        """
+        if self.vao is None:
+            self.vao = VAO()
+            self.instanceVbo = VBO()
+        shaderProg = self.displayObj.shaderProg
+        mesh.initialize(shaderProg)
+        self.vao.bind()
+        mesh.bindAttributes(shaderProg)
+        self.instanceVbo.setBuffer(self.packInstances(), self.instanceAttribSize, dynamic=True)
+        stride = self.instanceAttribSize
+        modelLoc = shaderProg.getAttribLocation("instanceModel")
+        for column in range(4):
+            self.instanceVbo.setAttribPointer(modelLoc + column, stride=stride, offset=4 * column, attribSize=4,
+                                              divisor=1)
+        normalLoc = shaderProg.getAttribLocation("instanceNormal")
+        for column in range(3):
+            self.instanceVbo.setAttribPointer(normalLoc + column, stride=stride, offset=16 + 3 * column, attribSize=3,
+                                              divisor=1)
+        self.instanceVbo.setAttribPointer(shaderProg.getAttribLocation("instanceDiffuse"), stride=stride, offset=25,
+                                          attribSize=4, divisor=1)
+        self.vao.unbind()
+        self.instanceMesh = mesh
+        self.instancesDirty = False
+
+    def drawSelf(self, shaderProg):
+        if self.instanceNum() == 0:
+            return
+        if self.displayObj.mesh is not self.instanceMesh:
+            self.buildVao(self.displayObj.mesh)
+        elif self.instancesDirty:
+            self.instanceVbo.setBuffer(self.packInstances(), self.instanceAttribSize, dynamic=True)
+            self.instancesDirty = False
+        self.applyDrawState(shaderProg, instanced=True)
+        self.vao.bind()
+        self.instanceMesh.ebo.drawInstanced(self.instanceNum())
+        self.vao.unbind()
+
+    def worldBoundingSphere(self):
+        """
+        Bounding sphere of all instances in world coordinates, None without instances
+        """
+        if self.instanceNum() == 0:
+            return None
+        center, radius = self.displayObj.boundingSphere()
+        scales = np.linalg.norm(self.instanceMats[:, 0, 0:3], axis=1)
+        centers = (np.append(center, 1) @ self.instanceMats)[:, 0:3]
+        localCenter, localRadius = GLUtility.enclosingSphere(centers, radius * scales)
+        worldCenter = np.append(localCenter, 1) @ self.transformationMat
+        scale = np.linalg.norm(self.transformationMat[0, 0:3])
+        return worldCenter[0:3], localRadius * scale
+
+    def intersectRayInstance(self, origin, direction):
+        """
+        Intersect a ray with all instances, testing triangles only of instances whose bounding spheres it hits
+
+        :param origin: ray origin in world coordinates
+        :param direction: normalized ray direction in world coordinates
+        :return: distance to the nearest hit and the index of the hit instance, None if the ray misses
+        :rtype: tuple
+        """
+        if self.instanceNum() == 0 or not self.displayObj.meshes():
+            return None
+        worldMats = self.instanceMats @ self.transformationMat
+        center, radius = self.displayObj.boundingSphere()
+        centers = (np.append(center, 1) @ worldMats)[:, 0:3]
+        radii = radius * np.linalg.norm(worldMats[:, 0, 0:3], axis=1)
+        entries = GLUtility.raySpheres(np.asarray(origin, dtype=np.float64), direction, centers, radii)
+        mesh = self.displayObj.meshes()[0]
+        best = None
+        for instance in np.argsort(entries):
+            if not np.isfinite(entries[instance]) or (best is not None and entries[instance] >= best[0]):
+                break
+            inverse = np.linalg.inv(worldMats[instance])
+            hit = mesh.intersectRay((np.append(origin, 1) @ inverse)[0:3], (np.append(direction, 0) @ inverse)[0:3])
+            if hit is not None and (best is None or hit[0] < best[0]):
+                best = (hit[0], int(instance))
+        return best
+
+    def intersectRay(self, origin, direction):
+        hit = self.intersectRayInstance(origin, direction)
+        return None if hit is None else hit[0]
+
+    def release(self):
+        """
+        Free the instance buffers, then everything Component.release frees
+        """
+        if self.vao is not None:
+            self.vao.delete()
+            self.instanceVbo.delete()
+            self.vao = None
+            self.instanceVbo = None
+            self.instanceMesh = None
+        super().release()
@@ -0,0 +1,120 @@
+"""
+Define a uniform buffer storing all lights of a GLProgram here. Light records are kept in a numpy structured array
+laid out exactly like the std140 Light array in the fragment shader, and only changed records are uploaded.
+
+:author: micou(Zezhou Sun)
+:version: 2021.1.1
+"""
+import numpy as np
+
+from GLBuffer import UBO
+from Light import Light
+
+# std140 layout of the Light struct: vec3 and vec4 members are aligned to 16 bytes, bool is stored as a 4 bytes int,
+# and the array stride is rounded up to a multiple of 16
+lightDtype = np.dtype({
+    "names": ["position", "color", "infiniteOn", "infiniteDirection",
+              "spotOn", "spotDirection", "spotRadialFactor", "spotAngleLimit"],
+    "formats": [(np.float32, 3), (np.float32, 4), np.int32, (np.float32, 3),
+                np.int32, (np.float32, 3), (np.float32, 3), np.float32],
+    "offsets": [0, 16, 32, 48, 60, 64, 80, 92],
+    "itemsize": 96,
+})
+
+
+class LightBuffer:
+    """
+    Light slots of a GLProgram, and the UBO they are uploaded to.
+
+    Slots are addressed by the index given to setLight, and each can be enabled or disabled. Flush packs the enabled
+    slots in use to the front of the uniform block, so the shader only loops over count lights, and uploads the
+    changed part of the block with one glBufferSubData.
+    """
+    records = None  # ndarray of lightDtype, one per slot
+    used = None  # ndarray of bool, slots which have been set since the last clear
+    enabled = None  # ndarray of bool
+    lights = None  # ndarray of lightDtype, CPU copy of the packed uniform block
+    count = 0  # number of packed lights in the uniform block
+    ubo = None
+    bindingPoint = 0
+    modified = False  # slots changed since the last flush
+
+    def __init__(self, lightsNum, bindingPoint=0):
+        """
+        :param lightsNum: array size of the Light block, must match MAX_LIGHT_NUM in the shader
+        :param bindingPoint: uniform block binding point this buffer is attached to
+        """
+        self.records = np.zeros(lightsNum, dtype=lightDtype)
+        self.used = np.zeros(lightsNum, dtype=bool)
+        self.enabled = np.ones(lightsNum, dtype=bool)
+        self.lights = np.zeros(lightsNum, dtype=lightDtype)
+        self.count = 0
+        self.bindingPoint = bindingPoint
+        self.ubo = UBO()
+        self.ubo.setBuffer(self.lights)
+        self.modified = False
+        self.bind()
+
+    def bind(self):
+        self.ubo.bindBase(self.bindingPoint)
+
+    def setLight(self, lightIndex: int, light: Light):
+        if not isinstance(light, Light):
+            raise TypeError("light type must be Light")
+        record = np.zeros(1, dtype=lightDtype)[0]
+        record["position"] = light.position
+        record["color"] = light.color
+        record["infiniteOn"] = light.infiniteOn
+        record["infiniteDirection"] = light.infiniteDirection
+        record["spotOn"] = light.spotOn
+        record["spotDirection"] = light.spotDirection
+        record["spotRadialFactor"] = light.spotRadialFactor
+        record["spotAngleLimit"] = light.spotAngleLimit
+        # compare the raw bytes, padding included, so unchanged lights never cause an upload
+        if self.used[lightIndex] and self.records[lightIndex].tobytes() == record.tobytes():
+            return
+        self.records[lightIndex] = record
+        self.used[lightIndex] = True
+        self.modified = True
+
+    def setEnabled(self, lightIndex: int, enabled: bool):
+        """
+        Disabled slots keep their light, but are left out of the uniform block
+        """
+        if self.enabled[lightIndex] != enabled:
+            self.enabled[lightIndex] = enabled
+            self.modified = True
+
+    def clear(self):
+        """
+        Remove lights from all slots
+        """
+        if self.used.any():
+            self.records[:] = np.zeros(1, dtype=lightDtype)
+            self.used[:] = False
+            self.modified = True
+
+    def flush(self):
+        """
+        Pack active slots and upload the rows which differ from the last upload, if any slot changed
+
+        :return: number of lights in the uniform block
+        :rtype: int
+        """
+        if not self.modified:
+            return self.count
+        packed = self.records[self.used & self.enabled]
+        count = len(packed)
+        rowBytes = lightDtype.itemsize
+        changedRows = np.nonzero(np.any(packed.view(np.uint8).reshape(count, rowBytes) !=
+                                        self.lights[:count].view(np.uint8).reshape(count, rowBytes), axis=1))[0]
+        if len(changedRows) > 0:
+            begin, end = changedRows[0], changedRows[-1] + 1
+            self.lights[begin:end] = packed[begin:end]
+            self.ubo.updateBuffer(int(begin) * rowBytes, self.lights[begin:end])
+        self.count = count
+        self.modified = False
+        return count
+
+    def delete(self):
+        self.ubo.delete()
@@ -0,0 +1,90 @@
+"""
+Define a persistent on-disk cache for generated meshes here, so high tessellation primitives are only generated once
+across program runs.
+
+:author: micou(Zezhou Sun)
+:version: 2021.1.1
+"""
+import hashlib
+import os
+
+import numpy as np
+
+
+class MeshCache:
+    """
+    Store vertices and indices as .npy files, named by a hash of the mesh key
+    (primitive class and all parameters which affect its geometry). Cached arrays are loaded memory-mapped.
+    """
+    enabled = True
+    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".meshcache")
+    # bump this when mesh generation changes, so that stale entries are never loaded
+    version = 1
+
+    hits = 0
+    misses = 0
+
+    @classmethod
+    def entryPath(cls, key):
+        """
+        :param key: hashable description of the mesh
+        :type key: tuple
+        :return: path prefix of the cache entry for key
+        """
+        digest = hashlib.sha1(repr((cls.version, key)).encode("utf-8")).hexdigest()
+        return os.path.join(cls.directory, digest)
+
+    @classmethod
+    def load(cls, key):
+        """
+        :return: memory-mapped vertices and indices, or None if key is not cached
+        """
+        if not cls.enabled:
+            return None
+        path = cls.entryPath(key)
+        try:
+            vertices = np.load(path + ".vertices.npy", mmap_mode="r")
+            indices = np.load(path + ".indices.npy", mmap_mode="r")
+        except (OSError, ValueError):
+            cls.misses += 1
+            return None
+        cls.hits += 1
+        return vertices, indices
+
+    @classmethod
+    def store(cls, key, vertices, indices):
+        """
+        Write vertices and indices for key. Failing to write only means the mesh will be generated again next time.
+        """
+        if not cls.enabled:
+            return
+        path = cls.entryPath(key)
+        try:
+            os.makedirs(cls.directory, exist_ok=True)
+            # indices goes first, and every file is renamed into place, so a half written entry never loads
+            for suffix, array in ((".indices.npy", indices), (".vertices.npy", vertices)):
+                tmpPath = f"{path}.{os.getpid()}.tmp{suffix}"
+                np.save(tmpPath, np.ascontiguousarray(array))
+                os.replace(tmpPath, path + suffix)
+        except OSError as e:
+            print("Warning: cannot write mesh cache entry:", e)
+
+    @classmethod
+    def stats(cls):
+        """
+        :return: cache hits and misses since the program started
+        :rtype: dict
+        """
+        return {"hits": cls.hits, "misses": cls.misses}
+
+    @classmethod
+    def clear(cls):
+        """
+        Remove all cache entries from disk and reset statistics
+        """
+        if os.path.isdir(cls.directory):
+            for fileName in os.listdir(cls.directory):
+                if fileName.endswith(".npy"):
+                    os.remove(os.path.join(cls.directory, fileName))
+        cls.hits = 0
+        cls.misses = 0
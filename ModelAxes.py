@@ -6,10 +6,14 @@ First version at 09/28/2021
 :version: 2021.2.1
 """
 
+import numpy as np
+
 from Component import Component
+from InstancedComponent import InstancedComponent
 from Point import Point
 import ColorType
 from DisplayableCube import DisplayableCube
+from GLUtility import GLUtility
 
 
 class ModelAxes(Component):
@@ -25,15 +29,11 @@ class ModelAxes(Component):
         self.components = []
         self.shaderProg = shaderProg
 
-        xAxes = Component(Point((1, 0, 0)), DisplayableCube(self.shaderProg, 0.05, 0.05, 2, ColorType.SOFTRED))
-        xAxes.setDefaultAngle(90, xAxes.vAxis)
-        xAxes.renderingRouting = "vertex"
-        yAxes = Component(Point((0, 1, 0)), DisplayableCube(self.shaderProg, 0.05, 0.05, 2, ColorType.SOFTGREEN))
-        yAxes.setDefaultAngle(-90, yAxes.uAxis)
-        yAxes.renderingRouting = "vertex"
-        zAxes = Component(Point((0, 0, 1)), DisplayableCube(self.shaderProg, 0.05, 0.05, 2, ColorType.SOFTBLUE))
-        zAxes.renderingRouting = "vertex"
-        self.addChild(xAxes)
-        self.addChild(yAxes)
-        self.addChild(zAxes)
-
+        # one white bar per axis, rotated from z onto x and y, and tinted by the instance colors in one draw call
+        axes = InstancedComponent(Point((0, 0, 0)), DisplayableCube(self.shaderProg, 0.05, 0.05, 2, ColorType.WHITE))
+        axes.renderingRouting = "vertex"
+        axes.addInstances(np.array([GLUtility.rotate(90, [0, 1, 0]) @ GLUtility.translate(1, 0, 0),
+                                    GLUtility.rotate(-90, [1, 0, 0]) @ GLUtility.translate(0, 1, 0),
+                                    GLUtility.translate(0, 0, 1)]),
+                          np.array([(*ColorType.SOFTRED, 1.0), (*ColorType.SOFTGREEN, 1.0), (*ColorType.SOFTBLUE, 1.0)]))
+        self.addChild(axes)
@@ -0,0 +1,97 @@
+"""
+Define a generator for tessellated parametric surfaces here. Sphere, ellipsoid, torus and cylinder are all
+parameterizations of the same (u, v) grid, so the grid sampling, vertex packing and quad triangulation live here once.
+
+:author: micou(Zezhou Sun)
+:version: 2021.1.1
+"""
+
+import numpy as np
+
+
+class ParametricSurface:
+    """
+    Sample a parametric surface on a stacks x slices grid and pack the result into vertex and index arrays.
+
+    u runs along the stacks (the rows of the grid), v runs along the slices (the columns of the grid). Both ranges
+    are sampled with their end points included, so a closed surface gets a duplicated seam column/row, which is
+    required for seamless texture mapping. If a direction is wrapped, the last row/column is also connected back to
+    the first one.
+
+    All callables are vectorized: they receive u and v as (stacks, slices) arrays and return a tuple of arrays with
+    the same shape.
+
+        * position(u, v) -> (x, y, z)
+        * normal(u, v) -> (nx, ny, nz), doesn't need to be normalized
+        * texture(u, v) -> (s, t)
+        * tangent(u, v) -> (P_u_x, P_u_y, P_u_z, P_v_x, P_v_y, P_v_z), optional
+
+    The generated vertices matrix follows this table:
+    Column | 0:3                | 3:6           | 6:9          | 9:11                        | 11:14     | 14:17
+    Stores | Vertex coordinates | Vertex normal | Vertex Color | Vertex texture Coordinates  | Tangent   | Bitangent
+    The last six columns only exist if a tangent callable is given.
+    """
+    uRange = None  # list<float>(2)
+    vRange = None  # list<float>(2)
+    stacks = 0
+    slices = 0
+    uWrap = False
+    vWrap = True
+
+    def __init__(self, uRange, vRange, stacks, slices, uWrap=False, vWrap=True):
+        self.uRange = uRange
+        self.vRange = vRange
+        self.stacks = stacks
+        self.slices = slices
+        self.uWrap = uWrap
+        self.vWrap = vWrap
+
+    def grid(self):
+        """
+        :return: u and v sampled on the whole grid, both in shape (stacks, slices)
+        """
+        return np.meshgrid(np.linspace(*self.uRange, self.stacks),
+                           np.linspace(*self.vRange, self.slices), indexing="ij")
+
+    def generate(self, position, normal, texture, color, tangent=None):
+        """
+        Evaluate all callables on the grid and pack them into interleaved vertices
+
+        :param color: vertex color shared by all vertices
+        :type color: ColorType
+        :return: vertices in shape (stacks * slices, 11 or 17) and triangle indices in shape (n, )
+        """
+        u, v = self.grid()
+        columnNum = 11 if tangent is None else 17
+
+        v_arr = np.empty((self.stacks, self.slices, columnNum))
+        v_arr[..., 0:3] = np.stack(position(u, v), axis=-1)
+        n = np.stack(normal(u, v), axis=-1)
+        # batched dot product through matmul, which rounds the same way as np.linalg.norm on a single vector
+        v_arr[..., 3:6] = n / np.sqrt(n[..., None, :] @ n[..., :, None])[..., 0]
+        v_arr[..., 6:9] = (color.r, color.g, color.b)
+        v_arr[..., 9:11] = np.stack(texture(u, v), axis=-1)
+        if tangent is not None:
+            v_arr[..., 11:17] = np.stack(tangent(u, v), axis=-1)
+
+        return v_arr.reshape(-1, columnNum), self.quadIndices()
+
+    def quadIndices(self):
+        """
+        Two triangles for every grid quad. Wrapped directions connect their last row/column to the first one.
+
+        :return: triangle indices in shape (n, )
+        """
+        stacks = self.stacks
+        slices = self.slices
+        stack = np.arange(stacks if self.uWrap else stacks - 1)[:, None]
+        slice = np.arange(slices if self.vWrap else slices - 1)[None, :]
+        next_stack = (stack + 1) % stacks
+        next_slice = (slice + 1) % slices
+        e_arr = np.stack([stack * slices + slice,
+                          next_stack * slices + slice,
+                          stack * slices + next_slice,
+                          stack * slices + next_slice,
+                          next_stack * slices + slice,
+                          next_stack * slices + next_slice], axis=-1)
+        return e_arr.reshape(-1)
@@ -0,0 +1,104 @@
+"""
+Define a queue collecting the draws of a frame and issuing them sorted by GL state.
+
+:author: micou(Zezhou Sun)
+:version: 2021.1.1
+"""
+
+
+class RenderQueue:
+    """
+    Components are added while traversing the scene, with a state key of
+    (shader variant, texture, material, mesh). Flush sorts the records by key, so draws sharing a program, a texture
+    or a mesh are issued next to each other, and the state shadows in GLProgram and Texture skip most of the GL calls
+    between them.
+
+    The number of state changes of the sorted order and of the traversal order are counted every flush, and kept in
+    lastFrameStats.
+    """
+    shaderProg = None
+    records = None  # list of (state key, traversal order, component)
+    lastFrameStats = None
+
+    # names of the state key fields, in sorting priority. Every draw binds its own VAO, so a mesh change is the
+    # cheapest one
+    stateFields = ("variant", "texture", "material", "mesh")
+
+    def __init__(self, shaderProg):
+        """
+        :param shaderProg: program all queued components are drawn with
+        :type shaderProg: GLProgram
+        """
+        self.shaderProg = shaderProg
+        self.records = []
+        self.lastFrameStats = {"draws": 0}
+        for field in self.stateFields:
+            self.lastFrameStats[field + "Changes"] = 0
+            self.lastFrameStats[field + "ChangesUnsorted"] = 0
+
+    def clear(self):
+        self.records.clear()
+
+    def __len__(self):
+        return len(self.records)
+
+    def stateKey(self, component):
+        """
+        :return: state key of a component, whose fields follow stateFields
+        :rtype: tuple
+        """
+        variant = self.shaderProg.routingFlag(component.renderingRouting)
+        if component.instanced:
+            variant |= self.shaderProg.instancedFlag
+        texture = component.texture.textureName if component.textureOn and component.texture is not None else 0
+        material = component.material
+        material = (tuple(material.diffuse), tuple(material.specular), tuple(material.ambient), material.highLight)
+        mesh = getattr(component.displayObj, "mesh", None)
+        mesh = -1 if mesh is None else mesh.serial
+        return variant, texture, material, mesh
+
+    def add(self, component):
+        """
+        :type component: Component
+        """
+        self.records.append((self.stateKey(component), len(self.records), component))
+
+    @staticmethod
+    def countChanges(keys, fieldIndex):
+        changes = 0
+        last = None
+        for key in keys:
+            if key[fieldIndex] != last:
+                changes += 1
+                last = key[fieldIndex]
+        return changes
+
+    def flush(self):
+        """
+        Draw all queued components in state-sorted order and empty the queue.
+        Every key field is stable between frames and runs, meshes are ordered by creation, and ties keep the traversal
+        order.
+
+        :return: statistics of this frame
+        :rtype: dict
+        """
+        unsortedKeys = [record[0] for record in self.records]
+        self.records.sort(key=lambda record: record[0:2])
+        sortedKeys = [record[0] for record in self.records]
+
+        for _, _, component in self.records:
+            component.drawSelf(self.shaderProg)
+
+        self.lastFrameStats["draws"] = len(self.records)
+        for i, field in enumerate(self.stateFields):
+            self.lastFrameStats[field + "Changes"] = self.countChanges(sortedKeys, i)
+            self.lastFrameStats[field + "ChangesUnsorted"] = self.countChanges(unsortedKeys, i)
+        self.clear()
+        return self.lastFrameStats
+
+    def stats(self):
+        """
+        :return: statistics of the last flush
+        :rtype: dict
+        """
+        return dict(self.lastFrameStats)
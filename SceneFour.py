@@ -81,26 +81,26 @@ class SceneFour(Component, Animation):
         
 
     def animationUpdate(self):
-        for i, v in enumerate(self.lights[0:2]):
-            theta = (self.A[i] + self.S[i]) % (2*np.pi)
-            self.A[i] = theta
-            x = self.R[i] * np.cos(theta)
-            y = self.R[i] * np.sin(theta)
-            self.suns[i].setCurrentPosition(Point((x, y, 0)))
-            self.lights[i].setPosition(Point((x, y, 0)))
-            self.shaderProg.setLight(i, v)
-
-        for i in range(len(self.planets)):
-            theta = (self.a[i] + self.s[i]) % (2*np.pi)
-            self.a[i] = theta
-            x = self.r[i] * np.cos(theta)
-            y = self.r[i] * np.sin(theta)
-            self.planets[i].setCurrentPosition(Point((x, y, 0)))
-            
-
-        for c in self.children:
-            if isinstance(c, Animation):
-                c.animationUpdate()
+        with self.batchUpdate():
+            for i, v in enumerate(self.lights[0:2]):
+                theta = (self.A[i] + self.S[i]) % (2*np.pi)
+                self.A[i] = theta
+                x = self.R[i] * np.cos(theta)
+                y = self.R[i] * np.sin(theta)
+                self.suns[i].setCurrentPosition(Point((x, y, 0)))
+                self.lights[i].setPosition(Point((x, y, 0)))
+                self.shaderProg.setLight(i, v)
+
+            for i in range(len(self.planets)):
+                theta = (self.a[i] + self.s[i]) % (2*np.pi)
+                self.a[i] = theta
+                x = self.r[i] * np.cos(theta)
+                y = self.r[i] * np.sin(theta)
+                self.planets[i].setCurrentPosition(Point((x, y, 0)))
+
+            for c in self.children:
+                if isinstance(c, Animation):
+                    c.animationUpdate()
 
     def initialize(self):
         self.shaderProg.clearAllLights()
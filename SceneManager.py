@@ -0,0 +1,210 @@
+"""
+Define a manager which builds every scene once and keeps the most recently used ones, GPU resources included.
+
+:author: micou(Zezhou Sun)
+:version: 2021.1.1
+"""
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from Displayable import Displayable
+
+
+class SceneManager:
+    """
+    Scenes are addressed by their index in sceneClasses. A scene is built the first time it is needed, and it stays in
+    a least recently used cache of at most capacity scenes. Evicted scenes release their meshes and textures.
+
+    Building has two phases. Constructing a scene generates its meshes, decodes its textures and wires its Components
+    without any GL call, so neighbouring scenes queued with prebuild are constructed on a thread pool. Creating the
+    GL objects afterwards must happen on the GL thread: buildPending uploads meshes and textures of constructed scenes,
+    one at a time, until a time budget is used up, so callers can spread the uploads over idle time between frames.
+    """
+    shaderProg = None
+    sceneClasses = None  # list<type>, scene constructors taking a GLProgram
+    capacity = 3
+    scenes = None  # OrderedDict<int, Component>, built scenes from least to most recently used
+    pending = None  # OrderedDict<int, Future>, scenes being constructed or uploaded
+    uploads = None  # dict<int, generator>, upload steps of constructed scenes, see uploadSteps
+    current = None  # index of the scene in use, never evicted
+
+    executor = None
+    onConstructed = None  # called without arguments on a worker thread whenever a scene finished construction
+
+    def __init__(self, shaderProg, sceneClasses, capacity=3, workers=2, onConstructed=None):
+        """
+        :param shaderProg: program passed to every scene constructor
+        :type shaderProg: GLProgram
+        :param sceneClasses: scene constructors
+        :param capacity: maximum number of built scenes, at least 1
+        :param workers: number of threads constructing scenes
+        :param onConstructed: lets the GL thread know that buildPending has work, e.g. wx.WakeUpIdle
+        :type onConstructed: callable
+        """
+        self.shaderProg = shaderProg
+        self.sceneClasses = list(sceneClasses)
+        self.capacity = max(1, capacity)
+        self.scenes = OrderedDict()
+        self.pending = OrderedDict()
+        self.uploads = {}
+        self.current = None
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="SceneManager")
+        self.onConstructed = onConstructed
+
+    def __len__(self):
+        return len(self.sceneClasses)
+
+    def get(self, index):
+        """
+        Make scene index the current one. A cached scene is returned right away, a pending one is finished, and any
+        other is built on the calling thread, which must own the GL context
+
+        :rtype: Component
+        """
+        if index in self.pending:
+            self.scenes[index] = self.finish(index)
+        elif index not in self.scenes:
+            self.scenes[index] = self.build(index)
+        self.scenes.move_to_end(index)
+        self.current = index
+        self.evict()
+        return self.scenes[index]
+
+    def construct(self, index):
+        """
+        CPU phase of building scene index: tessellation, texture decoding and Component wiring. Makes no GL call,
+        lights are only set once the scene is initialized as the current one
+
+        :rtype: Component
+        """
+        return self.sceneClasses[index](self.shaderProg)
+
+    def uploadSteps(self, scene):
+        """
+        GL phase of building scene, split in steps. Every step uploads one mesh or one texture, and meshes shared with
+        scenes built before are skipped
+
+        :return: generator yielding after every step
+        """
+        stack = [scene]
+        while stack:
+            component = stack.pop()
+            if isinstance(component.displayObj, Displayable):
+                for mesh in component.displayObj.meshes():
+                    if not mesh.initialized:
+                        mesh.initialize(self.shaderProg)
+                        yield
+            if component.texture is not None and component.texture.pendingImage is not None:
+                component.texture.upload()
+                yield
+            stack.extend(component.children)
+
+    def build(self, index):
+        """
+        Construct scene index and upload its meshes and textures, both on the calling thread
+        """
+        scene = self.construct(index)
+        for _ in self.uploadSteps(scene):
+            pass
+        return scene
+
+    def finish(self, index):
+        """
+        Wait for the construction of a pending scene, and upload whatever is left of it
+        """
+        future = self.pending.pop(index)
+        scene = future.result()
+        steps = self.uploads.pop(index, None) or self.uploadSteps(scene)
+        for _ in steps:
+            pass
+        return scene
+
+    def evict(self):
+        """
+        Release least recently used scenes until the cache fits its capacity
+        """
+        for index in list(self.scenes):
+            if len(self.scenes) <= self.capacity:
+                break
+            if index != self.current:
+                self.scenes.pop(index).release()
+
+    def prebuild(self, indices):
+        """
+        Start constructing scenes on the thread pool, e.g. the neighbours of the current scene. Never queues more than
+        the cache can keep next to the current scene
+        """
+        for index in indices:
+            index %= len(self.sceneClasses)
+            if len(self.pending) >= self.capacity - 1:
+                break
+            if index in self.scenes or index in self.pending:
+                continue
+            self.pending[index] = self.executor.submit(self.construct, index)
+            self.pending[index].add_done_callback(self.constructed)
+
+    def constructed(self, future):
+        """
+        Done callback of construction futures, runs on the worker thread
+        """
+        if self.onConstructed is not None:
+            self.onConstructed()
+
+    def buildPending(self, budget=0.004):
+        """
+        Upload constructed pending scenes step by step, until budget is used up. A completed scene counts as used
+        right before the current scene, since it is likely to be next. Scenes whose construction failed are dropped,
+        get builds them again and raises the error then
+
+        :param budget: time to spend, in seconds. At least one step is taken
+        :type budget: float
+        :return: True if constructed scenes are still waiting for uploads
+        :rtype: bool
+        """
+        deadline = time.perf_counter() + budget
+        for index, future in list(self.pending.items()):
+            if not future.done():
+                continue
+            if future.exception() is not None:
+                del self.pending[index]
+                continue
+            steps = self.uploads.setdefault(index, self.uploadSteps(future.result()))
+            for _ in steps:
+                if time.perf_counter() >= deadline:
+                    return True
+            del self.uploads[index]
+            del self.pending[index]
+            self.scenes[index] = future.result()
+            if self.current in self.scenes:
+                self.scenes.move_to_end(self.current)
+            self.evict()
+            if time.perf_counter() >= deadline:
+                break
+        return any(future.done() for future in self.pending.values())
+
+    def release(self):
+        """
+        Release every built or pending scene, except the current one
+        """
+        for index, future in list(self.pending.items()):
+            if not future.cancel() and future.exception() is None:
+                future.result().release()
+        self.pending.clear()
+        self.uploads.clear()
+        for index in list(self.scenes):
+            if index != self.current:
+                self.scenes.pop(index).release()
+
+    def shutdown(self):
+        """
+        Cancel queued constructions, wait for running ones, and release every scene, the current one included. Must
+        run on the GL thread while its context is still current, e.g. when the window is destroyed
+        """
+        # the GL thread may be gone once workers finish, don't notify it any more
+        self.onConstructed = None
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.release()
+        if self.current in self.scenes:
+            self.scenes.pop(self.current).release()
+        self.current = None
@@ -92,15 +92,16 @@ class SceneSix(Component, Animation):
         self.lAngles[0] = (self.lAngles[0] + 0.5) % 360
         self.lAngles[1] = (self.lAngles[1] + 0.7) % 360
         self.lAngles[2] = (self.lAngles[2] + 1.0) % 360
-        for i, v in enumerate(self.lights):
-            lPos = self.lightPos(self.lRadius, self.lAngles[i], self.lTransformations[i])
-            self.lightCubes[i].setCurrentPosition(Point(lPos))
-            self.lights[i].setPosition(lPos)
-            self.shaderProg.setLight(i, v)
-
-        for c in self.children:
-            if isinstance(c, Animation):
-                c.animationUpdate()
+        with self.batchUpdate():
+            for i, v in enumerate(self.lights):
+                lPos = self.lightPos(self.lRadius, self.lAngles[i], self.lTransformations[i])
+                self.lightCubes[i].setCurrentPosition(Point(lPos))
+                self.lights[i].setPosition(lPos)
+                self.shaderProg.setLight(i, v)
+
+            for c in self.children:
+                if isinstance(c, Animation):
+                    c.animationUpdate()
 
     def initialize(self):
         self.shaderProg.clearAllLights()
@@ -3,6 +3,7 @@ import numpy as np
 import ColorType
 from Animation import Animation
 from Component import Component
+from InstancedComponent import InstancedComponent
 from Light import Light
 from Material import Material
 from Point import Point
@@ -46,11 +47,7 @@ class SceneThree(Component):
         self.addChild(sphere1)
         # (3, 0.4, 0), red, not_infinite, spot_direction=(-1,0,0), 0.4d^2+0.5d+0.1, pi/6
         l1 = Light(Point((light_d, 0.4, 0)), np.array((*ColorType.PURPLE, 1.0)) * 5, None, np.array([1, 0, 0]), np.array([0.4, 0.5, 0.1]), np.pi/20)
-        lightCube1 = Component(Point((light_d, 0.4, 0)), DisplayableCube(shaderProg, 0.1, 0.1, 0.1, ColorType.PURPLE))
-        lightCube1.renderingRouting = "vertex"
         l1_test = Light(Point((-1, 0.4, 0)), np.array((*ColorType.PURPLE, 1.0)) * 5, None, np.array([1, 0, 0]), np.array([0.4, 0.5, 0.1]), np.pi/20)
-        lightCube1_test = Component(Point((-1, 0.4, 0)), DisplayableCube(shaderProg, 0.1, 0.1, 0.1, ColorType.PURPLE))
-        lightCube1_test.renderingRouting = "vertex"
 
         cube2 = Component(Point((obj_d, 0, -3)), DisplayableCube(shaderProg, 1, 1.2, 1.5, ColorType.PINK))
         cube2.setMaterial(m1)
@@ -58,8 +55,6 @@ class SceneThree(Component):
         self.addChild(cube2)
         # (3, 0.4, -3), green, not_infinite, spot_direction=(1,-1,0), 0.1d^2+0.2d+0.1, pi/6
         l2 = Light(Point((light_d, 0.4, -3)), np.array((*ColorType.GREEN, 1.0)))
-        lightCube2 = Component(Point((light_d, 0.4, -3)), DisplayableCube(shaderProg, 0.1, 0.1, 0.1, ColorType.GREEN))
-        lightCube2.renderingRouting = "vertex"
         
         
         # (3, 0.4, +3), blue, not_infinite, spot_direction=(1, -1,0), 0.1d^2+0.2d+0.1, pi/6
@@ -68,8 +63,6 @@ class SceneThree(Component):
         cylinder3.renderingRouting = "lighting"
         self.addChild(cylinder3)
         l3 = Light(Point((light_d, 0.4, 3)), np.array((*ColorType.BLUE, 1.0)))
-        lightCube3 = Component(Point((light_d, 0.4, 3)), DisplayableCube(shaderProg, 0.1, 0.1, 0.1, ColorType.BLUE))
-        lightCube3.renderingRouting = "vertex"
 
 
 
@@ -89,12 +82,15 @@ class SceneThree(Component):
 
 
 
-        self.addChild(lightCube1)
-        self.addChild(lightCube2)
-        self.addChild(lightCube3)
-        self.addChild(lightCube1_test)
+        # one white cube drawn at every light, tinted by the instance colors in a single draw call
+        lightCubes = InstancedComponent(Point((0, 0, 0)), DisplayableCube(shaderProg, 0.1, 0.1, 0.1, ColorType.WHITE))
+        lightCubes.renderingRouting = "vertex"
+        for position, color in (((light_d, 0.4, 0), ColorType.PURPLE), ((light_d, 0.4, -3), ColorType.GREEN),
+                                ((light_d, 0.4, 3), ColorType.BLUE), ((-1, 0.4, 0), ColorType.PURPLE)):
+            lightCubes.addInstance(Point(position), np.array((*color, 1.0)))
+        self.addChild(lightCubes)
         self.lights = [l1, l2, l3, l4, l1_test]
-        self.lightCubes = [lightCube1, lightCube2, lightCube3, lightCube1_test]
+        self.lightCubes = lightCubes
 
     def initialize(self):
         self.shaderProg.clearAllLights()
@@ -16,6 +16,7 @@ from Animation import Animation
 from ModelAxes import ModelAxes
 from Point import Point
 from CanvasBase import CanvasBase
+from Camera import Camera
 from GLProgram import GLProgram
 from GLBuffer import VAO, VBO, EBO, Texture
 import GLUtility
@@ -26,6 +27,11 @@ from SceneFour import SceneFour
 from SceneFive import SceneFive
 from SceneSix import SceneSix
 from Light import Light
+from MeshCache import MeshCache
+from RenderQueue import RenderQueue
+from BVH import BVH
+from SceneManager import SceneManager
+from TextureCache import TextureCache
 
 try:
     import wx
@@ -98,6 +104,10 @@ class Sketch(CanvasBase):
 
     texture = None
     shaderProg = None
+    renderQueue = None  # draws of a frame, issued sorted by GL state
+    bvh = None  # bounding volume hierarchy over the current scene, for culling and picking
+    pickedComponent = None  # Component under the last left click
+    pickedPoint = None  # ndarray(3), world coordinates of the clicked surface point
     glutility = None
 
     frameCount = 0
@@ -112,12 +122,15 @@ class Sketch(CanvasBase):
 
     viewMat = None
     perspMat = None
+    viewportChanged = False  # canvas resized since the viewport was last set
+    camera = None
 
     pauseScene = False
 
     # models
     basisAxes = None
     scene = None
+    sceneManager = None  # builds scenes once and caches them
 
     # If you are having trouble rotating the camera, try increasing this parameter
     # (Windows users with trackpads may need this)
@@ -146,11 +159,13 @@ class Sketch(CanvasBase):
         self.last_mouse_middlePosition = [0, 0]
         self.components = []
         self.backgroundColor = ColorType.BLUEGREEN
+        self.camera = Camera()
 
         # add components to top level
         self.resetView()
 
         self.glutility = GLUtility.GLUtility()
+        self.Bind(wx.EVT_IDLE, self.OnIdle)
 
     def resetView(self):
         self.lookAtPt = [0, 0, 0]
@@ -160,32 +175,71 @@ class Sketch(CanvasBase):
         self.cameraTheta = math.pi / 2
 
     def switchScene(self, scene):
+        # detach instead of destroying the old scene, SceneManager may bring it back later
+        if self.scene is not None:
+            self.topLevelComponent.removeChild(self.scene)
         self.scene = scene
-        self.topLevelComponent.clear()
         self.topLevelComponent.addChild(self.scene)
         self.topLevelComponent.initialize()
+        if self.bvh is None:
+            self.bvh = BVH(self.topLevelComponent)
+        else:
+            self.bvh.build(self.topLevelComponent)
+        if self.debug > 1:
+            print("mesh cache:", MeshCache.stats())
+            print("texture cache:", TextureCache.stats())
+
+    def showScene(self, index):
+        """
+        Switch to scene index, built or taken from the scene cache, and queue its neighbours for prebuilding
+
+        :param index: index in self.scenes
+        :type index: int
+        """
+        self.scenePointer = index
+        self.switchScene(self.sceneManager.get(index))
+        self.normalMappingOn = True if self.scenePointer == 0 else False
+        self.shaderProg.setBool(self.shaderProg.attribs["normalMappingOn"], self.normalMappingOn)
+        self.sceneManager.prebuild([index + 1, index - 1])
+
+    def OnIdle(self, event):
+        """
+        Upload prebuilt scenes for a few milliseconds whenever the event loop runs out of events
+        """
+        if self.init and self.sceneManager.pending:
+            self.SetCurrent(self.context)
+            if self.sceneManager.buildPending():
+                event.RequestMore()
 
     def InitGL(self):
+        # a new GL context starts without any program or texture bound
+        GLProgram.invalidateState()
+        Texture.invalidateState()
         self.shaderProg = GLProgram()
         self.shaderProg.compile()
+        self.renderQueue = RenderQueue(self.shaderProg)
 
 
         # instantiate models, then can only be done with a compiled GL program
         self.basisAxes = ModelAxes(self.shaderProg, Point((0, 0, 0)))
         self.basisAxes.initialize()
 
-        self.switchScene(SceneOne(self.shaderProg))
+        # scenes are built once and kept in a cache. Neighbours of the current scene are constructed on worker threads,
+        # which wake up the idle handler to upload them
+        self.scenes = [SceneOne, SceneTwo, SceneThree, SceneFour, SceneFive, SceneSix]
+        self.scenePointer = 0
+        self.sceneManager = SceneManager(self.shaderProg, self.scenes, capacity=4, onConstructed=wx.WakeUpIdle)
+        self.scene = None
+        self.showScene(self.scenePointer)
 
         gl.glClearColor(*self.backgroundColor, 1.0)
         gl.glClearDepth(1.0)
-        gl.glViewport(0, 0, self.size[0], self.size[1])
 
         # enable depth checking
         gl.glEnable(gl.GL_DEPTH_TEST)
 
         # set basic viewing matrix
-        self.perspMat = self.glutility.perspective(45, self.size.width, self.size.height, 0.01, 100)
-        self.shaderProg.setMat4("projectionMat", self.perspMat)
+        self.updateViewport()
         self.shaderProg.setMat4("viewMat", self.glutility.view(self.getCameraPos(), self.lookAtPt, self.upVector))
         self.shaderProg.setMat4("modelMat", np.identity(4))
         self.shaderProg.setVec3("viewPosition", np.array(self.getCameraPos()))
@@ -197,10 +251,6 @@ class Sketch(CanvasBase):
 
         self.shaderProg.setBool(self.shaderProg.attribs["normalMappingOn"], self.normalMappingOn)
 
-        # initialize the scenes
-        self.scenes = [SceneOne, SceneTwo, SceneThree, SceneFour, SceneFive, SceneSix]
-        self.scenePointer = 0
-
     def getCameraPos(self):
         ct = math.cos(self.cameraTheta)
         st = math.sin(self.cameraTheta)
@@ -212,16 +262,26 @@ class Sketch(CanvasBase):
         return result
 
     def OnResize(self, event):
-        contextAttrib = glcanvas.GLContextAttrs()
-        contextAttrib.PlatformDefaults().CoreProfile().MajorVersion(3).MinorVersion(3).EndList()
-        self.context = glcanvas.GLContext(self, ctxAttrs=contextAttrib)
+        if self.context is None:
+            contextAttrib = glcanvas.GLContextAttrs()
+            contextAttrib.PlatformDefaults().CoreProfile().MajorVersion(3).MinorVersion(3).EndList()
+            self.context = glcanvas.GLContext(self, ctxAttrs=contextAttrib)
         self.size = self.GetClientSize()
         self.size[1] = max(1, self.size[1])  # avoid divided by 0
-        self.SetCurrent(self.context)
 
-        self.init = False
-        self.Refresh(eraseBackground=True)
-        self.Update()
+        # the context and all GPU objects in it survive resizing, only the viewport and projection follow the new size
+        self.viewportChanged = True
+        self.requestRedraw()
+
+    def updateViewport(self):
+        """
+        Fit viewport and projection matrix to the canvas size
+        """
+        gl.glViewport(0, 0, self.size[0], self.size[1])
+        self.perspMat = self.glutility.perspective(45, self.size.width, self.size.height, 0.01, 100)
+        self.camera.setProjection(self.perspMat, self.size.width, self.size.height)
+        self.shaderProg.setMat4("projectionMat", self.perspMat)
+        self.viewportChanged = False
 
     def OnPaint(self, event=None):
         """
@@ -232,21 +292,35 @@ class Sketch(CanvasBase):
             # Init the OpenGL environment if not initialized
             self.InitGL()
             self.init = True
+        elif self.viewportChanged:
+            self.updateViewport()
         # the draw method
         self.OnDraw()
 
+    def needsContinuousRedraw(self):
+        """
+        Keep drawing frames while the scene is animated
+        """
+        return not self.pauseScene and isinstance(self.scene, Animation)
+
     def OnDraw(self):
         gl.glClearColor(*self.backgroundColor, 1.0)
         gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
 
         self.viewMat = self.glutility.view(self.getCameraPos(), self.lookAtPt, self.upVector)
+        self.camera.setView(self.getCameraPos(), self.viewMat)
         self.shaderProg.setMat4("viewMat", self.viewMat)
         self.shaderProg.setVec3("viewPosition", np.array(self.getCameraPos()))
 
         if not self.pauseScene and isinstance(self.scene, Animation):
             self.scene.animationUpdate()
         self.topLevelComponent.update(np.identity(4))
-        self.topLevelComponent.draw(self.shaderProg)
+        self.shaderProg.flushLights()
+        self.bvh.refit()
+        self.bvh.collect(self.renderQueue, self.camera)
+        frameStats = self.renderQueue.flush()
+        if self.debug > 2:
+            print("render queue:", frameStats)
 
         # draw the axes on the canvas bottom right corner
         resultPt = self.unprojectCanvas(0.9 * self.size[0], 0.1 * self.size[1], 0.3)
@@ -262,6 +336,12 @@ class Sketch(CanvasBase):
         :param event: Window destroy event
         :return: None
         """
+        if self.sceneManager is not None:
+            # GL objects of cached scenes can only be freed with the context current
+            self.SetCurrent(self.context)
+            self.sceneManager.shutdown()
+            self.sceneManager = None
+            TextureCache.evictUnused()
         if self.shaderProg is not None:
             del self.shaderProg
         super(Sketch, self).OnDestroy(event)
@@ -284,28 +364,45 @@ class Sketch(CanvasBase):
         unproject a canvas point to world coordiantes. 2D -> 3D
         you need give an extra parameter u, to tell the method how far are you from znear
         u is the proportion of distance to znear / zfar-znear
-        in the gluUnProject, the distribution of z is not linear when using perspective projection,
-        so z=0.5 is not in the middle,
+        the distribution of window depth is not linear when using perspective projection,
+        so depth=0.5 is not in the middle,
         that's why we compute out the ray and use linear interpolation and u to get the point
 
         :param u: u is the proportion to the znear/, in range [0, 1]
         :type u: float
         """
-        result1 = glu.gluUnProject(x, y, 0.0,
-                                   np.identity(4),
-                                   self.viewMat @ self.perspMat,
-                                   gl.glGetIntegerv(gl.GL_VIEWPORT))
-        result2 = glu.gluUnProject(x, y, 1.0,
-                                   np.identity(4),
-                                   self.viewMat @ self.perspMat,
-                                   # be careful, the concate of view and persp is called projection matrix in opengl
-                                   gl.glGetIntegerv(gl.GL_VIEWPORT))
-        result = Point([(1 - u) * r1 + u * r2 for r1, r2 in zip(result1, result2)])
-        return result
+        return Point(self.unprojectCanvasPoints([(x, y, u)])[0])
+
+    def unprojectCanvasPoints(self, canvasPoints):
+        """
+        unprojectCanvas for many points at once, with the camera's cached inverse view-projection matrix
+
+        :param canvasPoints: (x, y, u) of every point, in shape (n, 3)
+        :return: world coordinates in shape (n, 3)
+        :rtype: numpy.ndarray
+        """
+        canvasPoints = np.asarray(canvasPoints, dtype=np.float64).reshape(-1, 3)
+        n = len(canvasPoints)
+        windowPoints = np.concatenate((np.tile(canvasPoints[:, 0:2], (2, 1)),
+                                       np.repeat([[0.0], [1.0]], n, axis=0)), axis=1)
+        worldPoints = self.camera.unprojectPoints(windowPoints)
+        u = canvasPoints[:, 2:3]
+        return (1 - u) * worldPoints[0:n] + u * worldPoints[n:]
+
+    def pick(self, x, y):
+        """
+        Find the Component under a canvas point, by casting the ray between its unprojected points on the near and far
+        planes
+
+        :return: the hit Component and the hit point in world coordinates, (None, None) if nothing is hit
+        :rtype: tuple
+        """
+        nearPt, farPt = self.unprojectCanvasPoints([(x, y, 0), (x, y, 1)])
+        return self.bvh.pick(nearPt, farPt - nearPt, np.linalg.norm(farPt - nearPt))
 
     def Interrupt_MouseL(self, x, y):
         """
-        When mouse click detected, store current position in last_mouse_leftPosition
+        When mouse click detected, store current position in last_mouse_leftPosition, and pick the Component under it
 
         :param x: Mouse click's x coordinate
         :type x: int
@@ -315,6 +412,9 @@ class Sketch(CanvasBase):
         """
         self.last_mouse_leftPosition[0] = x
         self.last_mouse_leftPosition[1] = y
+        self.pickedComponent, self.pickedPoint = self.pick(x, y)
+        if self.debug > 1 and self.pickedComponent is not None:
+            print("picked:", type(self.pickedComponent.displayObj).__name__, "at", self.pickedPoint)
 
     def Interrupt_MouseMiddleDragging(self, x, y):
         """
@@ -391,21 +491,12 @@ class Sketch(CanvasBase):
         if keycode in [wx.WXK_RETURN]:
             self.update()
         if keycode in [wx.WXK_LEFT]:
-            self.scenePointer = (self.scenePointer + len(self.scenes) - 1) % len(self.scenes)
+            self.showScene((self.scenePointer + len(self.scenes) - 1) % len(self.scenes))
             print(f"current scene: {self.scenePointer + 1}")
-            self.switchScene(self.scenes[self.scenePointer](self.shaderProg))
-
-            self.normalMappingOn = True if self.scenePointer == 0 else False
-            self.shaderProg.setBool(self.shaderProg.attribs["normalMappingOn"], self.normalMappingOn)
-
             self.update()
         if keycode in [wx.WXK_RIGHT]:
-            self.scenePointer = (self.scenePointer + len(self.scenes) + 1) % len(self.scenes)
+            self.showScene((self.scenePointer + len(self.scenes) + 1) % len(self.scenes))
             print(f"current scene: {self.scenePointer + 1}")
-            self.switchScene(self.scenes[self.scenePointer](self.shaderProg))
-
-            self.normalMappingOn = True if self.scenePointer == 0 else False
-            self.shaderProg.setBool(self.shaderProg.attribs["normalMappingOn"], self.normalMappingOn)
             self.update()
         if keycode in [wx.WXK_UP]:
             self.Interrupt_Scroll(1)
@@ -437,12 +528,9 @@ class Sketch(CanvasBase):
         # TODO 5.3 is at here
         if chr(keycode) in "1234":
             i = int(chr(keycode)) - 1
-            print(f"now setting light {i} to none...")
             self.lightOn[i] = not self.lightOn[i]
-            if self.lightOn[i] == False:
-                self.scene.shaderProg.setLight(i, Light(None))
-            elif i < len(self.scene.lights):
-                self.scene.shaderProg.setLight(i, self.scene.lights[i])
+            print(f"now turning light {i} {'on' if self.lightOn[i] else 'off'}...")
+            self.scene.shaderProg.setLightEnabled(i, self.lightOn[i])
 
 
 
@@ -0,0 +1,124 @@
+"""
+Define a cache of textures here, so that every image file is decoded and uploaded only once.
+
+:author: micou(Zezhou Sun)
+:version: 2021.1.1
+"""
+import os
+import threading
+
+import numpy as np
+from PIL import Image
+
+from GLBuffer import Texture
+
+
+class TextureCache:
+    """
+    Process-wide registry of Texture, keyed by absolute image path and modification time, so an edited file is loaded
+    again. Components using the same image share one Texture, and thereby one GL texture name. Textures are reference
+    counted.
+
+    A texture nobody uses any more stays resident, so switching back to a scene doesn't decode its images again. evict
+    and evictUnused free them explicitly. GL textures are only created by Texture.upload, so acquire may run on any
+    thread, while release and eviction may delete GL textures and must run on the GL thread.
+    """
+    textures = {}  # dict<tuple, Texture>
+    loading = {}  # dict<tuple, threading.Event>, keys some thread is decoding right now
+    lock = threading.Lock()
+
+    hits = 0
+    misses = 0
+
+    @staticmethod
+    def textureKey(imgFilePath):
+        path = os.path.abspath(imgFilePath)
+        return path, os.path.getmtime(path)
+
+    @classmethod
+    def acquire(cls, imgFilePath):
+        """
+        Get the texture of an image file, and take a reference to it. The image is decoded on cache miss
+
+        :param imgFilePath: path of an image file PIL can read
+        :type imgFilePath: str
+        :rtype: Texture
+        """
+        key = cls.textureKey(imgFilePath)
+        while True:
+            with cls.lock:
+                texture = cls.textures.get(key)
+                if texture is not None:
+                    texture.refCount += 1
+                    cls.hits += 1
+                    return texture
+                done = cls.loading.get(key)
+                if done is None:
+                    done = cls.loading[key] = threading.Event()
+                    break
+            # another thread decodes this image, look it up again once it is done
+            done.wait()
+
+        try:
+            texture = Texture()
+            texture.key = key
+            texture.loadImage(np.array(Image.open(key[0]).convert("RGB"), dtype=np.uint8))
+            with cls.lock:
+                cls.textures[key] = texture
+                texture.refCount += 1
+                cls.misses += 1
+        finally:
+            with cls.lock:
+                del cls.loading[key]
+            done.set()
+        return texture
+
+    @classmethod
+    def release(cls, texture):
+        """
+        Drop one reference to texture. Unused textures stay in the cache until evicted, except those evicted while in
+        use, which are deleted with their last reference
+
+        :type texture: Texture
+        """
+        with cls.lock:
+            texture.refCount -= 1
+            if texture.refCount <= 0 and cls.textures.get(texture.key) is not texture:
+                texture.delete()
+
+    @classmethod
+    def evict(cls, imgFilePath):
+        """
+        Remove every version of an image file from the cache. Textures in use are deleted once their last user
+        releases them, and the next acquire loads the file again
+        """
+        path = os.path.abspath(imgFilePath)
+        with cls.lock:
+            for key in [key for key in cls.textures if key[0] == path]:
+                texture = cls.textures.pop(key)
+                if texture.refCount <= 0:
+                    texture.delete()
+
+    @classmethod
+    def evictUnused(cls):
+        """
+        Delete every texture without references
+
+        :return: number of deleted textures
+        :rtype: int
+        """
+        with cls.lock:
+            unused = [key for key, texture in cls.textures.items() if texture.refCount <= 0]
+            for key in unused:
+                cls.textures.pop(key).delete()
+        return len(unused)
+
+    @classmethod
+    def stats(cls):
+        """
+        :return: cache hits and misses since the program started, and the number of resident and unused textures
+        :rtype: dict
+        """
+        with cls.lock:
+            unused = sum(1 for texture in cls.textures.values() if texture.refCount <= 0)
+            return {"hits": cls.hits, "misses": cls.misses, "resident": len(cls.textures), "unused": unused}